@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
+
+
+class optional_build_ext(build_ext):
+    # Analyseur MFM compile optionnel: le code Python est utilise s'il ne
+    # peut pas etre construit
+    def run(self):
+        try:
+            build_ext.run(self)
+        except Exception as e:
+            print('_ftdos_mfm not built: %s' % e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except Exception as e:
+            print('%s not built: %s' % (ext.name, e))
+
+
+setup(name='ftdos',
+      version='0.2',
+      description='Gestion des images FTDOS',
+      license='EUPL-1.1',
+      package_dir={'': 'src'},
+      packages=['ftdos'],
+      ext_modules=[Extension('ftdos._ftdos_mfm', ['src/ftdos/_ftdos_mfm.c'])],
+      cmdclass={'build_ext': optional_build_ext},
+      entry_points={'console_scripts': ['ftdos = ftdos.cli:main'],
+                    # Chargement du lecteur par les outils hotes (__plugin_type__)
+                    'dsk.plugins': ['ftdos = ftdos']
+                    }
+      )
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: bench_ftdos.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.1 $
+#
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import timeit
+
+import argparse
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import ftdos
+import mkftdos
+
+# ------------------------------------------------------------------------------
+__program_name__ = 'bench_ftdos'
+__description__ = "Mesure des performances de ftdos sur des images generees"
+__version__ = 0.1
+
+
+# ------------------------------------------------------------------------------
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def peak_rss(who='self'):
+    # Pic de memoire residente en Ko (Linux), depuis le debut du processus:
+    # ru_maxrss n'est jamais remis a zero. Pour 'children', pic du plus gros
+    # processus fils termine.
+    if resource is None:
+        return None
+
+    if who == 'children':
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def generate(directory, count, files, min_size, max_size, sides, tracks, fragmentation):
+    images = []
+
+    for i in range(0, count):
+        filename = os.path.join(directory, 'bench%04d.dsk' % i)
+        mkftdos.make_image(filename, mkftdos.random_files(files, min_size, max_size, seed=i), sides, tracks, fragmentation, seed=i)
+        images.append(filename)
+
+    return images
+
+
+def open_image(diskimg, catalog=False):
+    fs = ftdos.ftdos(diskimg)
+    fs.validate(diskimg)
+
+    if catalog:
+        fs.read_dir()
+
+    return fs
+
+
+def phase_validate(images):
+    size = 0
+    for diskimg in images:
+        fs = ftdos.ftdos(diskimg)
+        fs.validate(diskimg)
+        fs.close()
+        size += os.path.getsize(diskimg)
+
+    return size
+
+
+def phase_index(filesystems, python=False):
+    size = 0
+    for fs in filesystems:
+        if python:
+            fs.build_index_python()
+        else:
+            fs.build_index()
+        size += os.path.getsize(fs.source)
+
+    return size
+
+
+def check_parser(filesystems):
+    # L'analyseur compile doit produire exactement l'index de l'analyseur Python
+    return all([fs.build_index() == fs.build_index_python() for fs in filesystems])
+
+
+def phase_cat(filesystems):
+    size = 0
+    for fs in filesystems:
+        fs.FTDOS_cat()
+        size += os.path.getsize(fs.source)
+
+    return size
+
+
+def phase_read_file(filesystems):
+    size = 0
+    for fs in filesystems:
+        for filename in fs.dirents:
+            size += len(fs.FTDOS_read_file(filename)['file'])
+
+    return size
+
+
+def phase_getsys(filesystems):
+    size = 0
+    for fs in filesystems:
+        size += len(fs.FTDOS_getsys(4))
+
+    return size
+
+
+def package_env():
+    # Environnement des sous-processus: le paquet ftdos doit etre importable
+    env = dict(os.environ)
+    path = os.path.dirname(os.path.dirname(os.path.abspath(ftdos.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([path] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    return env
+
+
+def phase_cli(images, workdir):
+    size = 0
+    env = package_env()
+
+    with open(os.devnull, 'w') as null:
+        for diskimg in images:
+            output = tempfile.mkdtemp(dir=workdir)
+            subprocess.check_call([sys.executable, '-m', 'ftdos', diskimg, '*'], cwd=output, stdout=null, env=env)
+            shutil.rmtree(output)
+            size += os.path.getsize(diskimg)
+
+    return size
+
+
+def measure_import(module, repeat):
+    # Duree d'un 'import module' dans un nouvel interpreteur, moins celle de
+    # l'interpreteur seul, et nombre de modules charges
+    env = package_env()
+    code = 'import sys, timeit; t = timeit.default_timer(); import %s; sys.stdout.write("%%r %%d\\n" %% (timeit.default_timer() - t, len(sys.modules)))'
+    best = None
+
+    for _ in range(0, repeat):
+        out = subprocess.check_output([sys.executable, '-c', code % module], env=env)
+        seconds, modules = out.split()
+        seconds = float(seconds)
+
+        if best is None or seconds < best[0]:
+            best = (seconds, int(modules))
+
+    return {'module': module, 'seconds': best[0], 'modules': best[1]}
+
+
+def reopen(filesystems):
+    # Images reouvertes, catalogue relu: les caches des fichiers et du
+    # systeme sont vides, seule la lecture est mesuree
+    for fs in filesystems:
+        fs.close()
+        fs.validate(fs.source)
+        fs.read_dir()
+
+
+def measure(name, count, repeat, func, *args, **kwargs):
+    # setup: appele avant chaque repetition, hors mesure
+    setup = kwargs.get('setup')
+    best = None
+    size = 0
+
+    for _ in range(0, repeat):
+        if setup is not None:
+            setup(*args)
+
+        start = timeit.default_timer()
+        size = func(*args)
+        elapsed = timeit.default_timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return {'phase': name,
+            'seconds': best,
+            'images': count,
+            'bytes': size,
+            'images_per_s': count / best if best else None,
+            'mb_per_s': size / best / (1024 * 1024) if best else None,
+            # Pic cumule: une phase executee dans le processus du banc de test
+            # herite du pic des phases precedentes
+            'cumulative_peak_rss_kb': peak_rss('children' if name == 'cli' else 'self')
+            }
+
+
+# ------------------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(prog=__program_name__, description=__description__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--images', type=int, default=20, help='number of generated images')
+    parser.add_argument('--files', type=int, default=20, help='number of files per image')
+    parser.add_argument('--min-size', type=int, default=256, help='minimum file size')
+    parser.add_argument('--max-size', type=int, default=4096, help='maximum file size')
+    parser.add_argument('--sides', type=int, default=2, help='number of sides')
+    parser.add_argument('--tracks', type=int, default=41, help='number of tracks per side')
+    parser.add_argument('--fragmentation', type=float, default=0.5, help='probability of a random sector allocation (0-1)')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='repetitions per phase (best time is kept)')
+    parser.add_argument('--no-cli', action='store_true', help='skip the command line extraction phase')
+    parser.add_argument('--import-only', action='store_true', help='only measure the import time of the library and of the command line')
+    parser.add_argument('--output', '-o', type=str, default=None, help='JSON report file (default: stdout)')
+    parser.add_argument('--version', '-V', action='version', version='%%(prog)s v%s' % __version__)
+
+    args = parser.parse_args()
+
+    imports = [measure_import(module, max(args.repeat, 5)) for module in ('ftdos', 'ftdos.cli')]
+
+    if args.import_only:
+        report = {'python': sys.version.split()[0], 'ftdos': ftdos.__version__, 'import': imports}
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='ftdos-bench-')
+
+    try:
+        images = generate(workdir, args.images, args.files, args.min_size, args.max_size, args.sides, args.tracks, args.fragmentation)
+        count = len(images)
+
+        results = [measure('validate', count, args.repeat, phase_validate, images)]
+
+        filesystems = [open_image(diskimg) for diskimg in images]
+        results.append(measure('index', count, args.repeat, phase_index, filesystems))
+        if ftdos.core._ftdos_mfm is not None:
+            results.append(measure('index_python', count, args.repeat, phase_index, filesystems, True))
+            parser_ok = check_parser(filesystems)
+        else:
+            parser_ok = None
+
+        results.append(measure('cat', count, args.repeat, phase_cat, filesystems))
+
+        results.append(measure('read_file', count, args.repeat, phase_read_file, filesystems, setup=reopen))
+        results.append(measure('getsys', count, args.repeat, phase_getsys, filesystems, setup=reopen))
+
+        for fs in filesystems:
+            fs.close()
+
+        if not args.no_cli:
+            results.append(measure('cli', count, args.repeat, phase_cli, images, workdir))
+
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {'python': sys.version.split()[0],
+              'ftdos': ftdos.__version__,
+              'parameters': vars(args),
+              'accelerated': ftdos.core._ftdos_mfm is not None,
+              'parser_equivalent': parser_ok,
+              'import': imports,
+              'results': results
+              }
+
+    if args.output is None:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if parser_ok is False:
+        eprint('MFM parser mismatch')
+        sys.exit(1)
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: __init__.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.4 $
+#
+# Lecteur d'images FTDOS.
+#
+# L'import du paquet ne charge que le lecteur (core.py), la ligne de commande
+# et ses dependances (argparse, json, multiprocessing...) sont dans cli.py.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from .core import __program_name__, __description__, __plugin_type__, __version__
+
+from .core import ftdos, SectorLoc, FileExtent, DirEntry, FTDOS_Catalog, FTDOS_Selector, FTDOS_SectorError
+from .core import FTDOS_Bitmap, FTDOS_Cache, FTDOS_Store, FTDOS_Stats, FTDOS_File
+from .core import dump, dump_to, write_header, extract_files, extract_image, iter_image_files, verify_image
+from .core import image_signature, diff_signatures, diff_image
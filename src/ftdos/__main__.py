@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# python -m ftdos
+# ------------------------------------------------------------------------------
+
+from ftdos.cli import main
+
+main()
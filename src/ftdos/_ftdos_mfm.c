@@ -0,0 +1,199 @@
+/* -----------------------------------------------------------------------------
+ * vim: set ts=4 ai :
+ *
+ * $Id: _ftdos_mfm.c $
+ * $Author: assinie <github@assinie.info> $
+ * $Date: 2018-02-27 $
+ * $Revision: 0.1 $
+ *
+ * Analyse optionnelle des pistes MFM_DISK pour ftdos.core
+ *
+ * scan(image, offset, sides, tracks, tracksize[, record]) renvoie le meme
+ * index que ftdos.build_index():
+ *   (face, piste, secteur) -> (id_ptr, data_ptr, taille, id_crc, data_crc)
+ *
+ * record est une sous-classe de tuple (ftdos.SectorLoc) utilisee pour les
+ * valeurs de l'index.
+ *
+ * Compilation: python setup.py build_ext --inplace, ou dans src/ftdos/
+ *   cc -O2 -shared -fPIC $(python-config --includes) _ftdos_mfm.c -o _ftdos_mfm.so
+ * -------------------------------------------------------------------------- */
+
+#include <Python.h>
+
+/* CRC-CCITT (polynome 0x1021), identique a binascii.crc_hqx */
+static unsigned short crc_table[256];
+static unsigned short crc_sync;
+
+static unsigned short crc16(unsigned short crc, const unsigned char *p, Py_ssize_t len)
+{
+	while (len-- > 0)
+		crc = (unsigned short)((crc << 8) ^ crc_table[((crc >> 8) ^ *p++) & 0xff]);
+
+	return crc;
+}
+
+static void crc_init(void)
+{
+	static const unsigned char sync[3] = {0xa1, 0xa1, 0xa1};
+	int i, j;
+
+	for (i = 0; i < 256; i++) {
+		unsigned short crc = (unsigned short)(i << 8);
+
+		for (j = 0; j < 8; j++)
+			crc = (unsigned short)((crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1);
+
+		crc_table[i] = crc;
+	}
+
+	/* Etat apres les 3 octets de synchronisation A1 */
+	crc_sync = crc16(0xffff, sync, 3);
+}
+
+static int add_sector(PyObject *index, PyTypeObject *record, long side, long track, int S, Py_ssize_t id_ptr, Py_ssize_t data_ptr, int n, int id_crc, int data_crc)
+{
+	PyObject *key, *value;
+	int ret;
+
+	key = Py_BuildValue("(lli)", side, track, S);
+
+	if (record == NULL) {
+		value = Py_BuildValue("(nniOO)", id_ptr, data_ptr, n, id_crc ? Py_True : Py_False, data_crc ? Py_True : Py_False);
+	} else {
+		/* Construction directe de la sous-classe de tuple, sans passer par
+		 * son __new__ Python */
+		PyObject *args = Py_BuildValue("((nniOO))", id_ptr, data_ptr, n, id_crc ? Py_True : Py_False, data_crc ? Py_True : Py_False);
+
+		value = args ? PyTuple_Type.tp_new(record, args, NULL) : NULL;
+		Py_XDECREF(args);
+	}
+
+	if (key == NULL || value == NULL) {
+		Py_XDECREF(key);
+		Py_XDECREF(value);
+		return -1;
+	}
+
+	ret = PyDict_SetItem(index, key, value);
+	Py_DECREF(key);
+	Py_DECREF(value);
+
+	return ret;
+}
+
+static PyObject *scan(PyObject *self, PyObject *args)
+{
+	Py_buffer buf;
+	Py_ssize_t offset, tracksize, size;
+	long sides, tracks, side, track;
+	const unsigned char *image;
+	PyObject *index, *record = NULL;
+
+	if (!PyArg_ParseTuple(args, "s*nlln|O", &buf, &offset, &sides, &tracks, &tracksize, &record))
+		return NULL;
+
+	if (record == Py_None)
+		record = NULL;
+
+	if (record != NULL && !(PyType_Check(record) && PyType_IsSubtype((PyTypeObject *)record, &PyTuple_Type))) {
+		PyBuffer_Release(&buf);
+		PyErr_SetString(PyExc_TypeError, "record must be a tuple subclass");
+		return NULL;
+	}
+
+	image = (const unsigned char *)buf.buf;
+	size = buf.len;
+
+	index = PyDict_New();
+	if (index == NULL) {
+		PyBuffer_Release(&buf);
+		return NULL;
+	}
+
+	for (side = 0; side < sides; side++) {
+		for (track = 0; track < tracks; track++) {
+			Py_ssize_t ptr = offset + (side * tracks + track) * tracksize;
+			Py_ssize_t eot = ptr + tracksize;
+
+			if (eot > size)
+				eot = size;
+
+			while (ptr < eot) {
+				Py_ssize_t id_ptr, length, end;
+				unsigned short stored;
+				int S, n, id_crc, data_crc;
+
+				while (ptr < eot && image[ptr] != 0xfe)
+					ptr++;
+
+				if (ptr >= eot || ptr + 7 > eot)
+					break;
+
+				id_ptr = ptr;
+				S = image[ptr + 3];
+				n = image[ptr + 4];
+
+				id_crc = crc16(crc_sync, image + ptr, 5) == ((image[ptr + 5] << 8) | image[ptr + 6]);
+
+				/* skip ID field & crc */
+				ptr += 7;
+
+				while (ptr < eot && image[ptr] != 0xfb && image[ptr] != 0xfe)
+					ptr++;
+
+				if (ptr >= eot)
+					break;
+
+				/* Taille hors limites: le secteur deborde de l'image */
+				if (n + 7 > 30)
+					length = size + 1;
+				else
+					length = (Py_ssize_t)1 << (n + 7);
+
+				end = (length > size - ptr) ? size + 1 : ptr + length + 1;
+
+				stored = (unsigned short)(((end < size ? image[end] : 0) << 8) | (end + 1 < size ? image[end + 1] : 0));
+				data_crc = crc16(crc_sync, image + ptr, (end < size ? end : size) - ptr) == stored;
+
+				if (add_sector(index, (PyTypeObject *)record, side, track, S, id_ptr, ptr + 1, n, id_crc, data_crc) < 0) {
+					Py_DECREF(index);
+					PyBuffer_Release(&buf);
+					return NULL;
+				}
+
+				/* Skip data field and ID */
+				if (length > size - ptr)
+					break;
+
+				ptr += length + 3;
+			}
+		}
+	}
+
+	PyBuffer_Release(&buf);
+	return index;
+}
+
+static PyMethodDef methods[] = {
+	{"scan", scan, METH_VARARGS, "scan(image, offset, sides, tracks, tracksize[, record]) -> sector index"},
+	{NULL, NULL, 0, NULL}
+};
+
+#if PY_MAJOR_VERSION >= 3
+static struct PyModuleDef module = {
+	PyModuleDef_HEAD_INIT, "_ftdos_mfm", NULL, -1, methods
+};
+
+PyMODINIT_FUNC PyInit__ftdos_mfm(void)
+{
+	crc_init();
+	return PyModule_Create(&module);
+}
+#else
+PyMODINIT_FUNC init_ftdos_mfm(void)
+{
+	crc_init();
+	Py_InitModule("_ftdos_mfm", methods);
+}
+#endif
@@ -0,0 +1,908 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: cli.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.4 $
+#
+# Ligne de commande: extraction, batch, verify, export, mount, index, query
+# et diff
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+from pprint import pprint
+
+import os
+import io
+import re
+import sys
+import time
+
+import argparse
+
+from .core import __program_name__, __description__, __version__
+from .core import eprint, _text, ftdos, FTDOS_Cache, FTDOS_Store, FTDOS_Selector, FTDOS_SectorError, FTDOS_Stats, NO_TIMER
+from .core import extract_files, extract_image, iter_image_files, verify_image, image_signature, diff_image
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_Archive():
+    # Archive tar ou zip ecrite au fil de l'eau, sans fichier intermediaire
+    FORMATS = {'tar': 'w', 'tgz': 'w:gz', 'tbz2': 'w:bz2', 'zip': None}
+
+    # Modes tar en continu pour les flux non seekable (stdout)
+    STREAM_FORMATS = {'tar': 'w|', 'tgz': 'w|gz', 'tbz2': 'w|bz2'}
+
+    def __init__(self, filename, format=None, mtime=None):
+        if format is None:
+            format = self.guess_format(filename)
+
+        self.format = format
+        self.mtime = mtime if mtime is not None else time.time()
+
+        # tarfile et zipfile ne sont charges que par la commande export
+        import tarfile
+        import zipfile
+
+        if format == 'zip':
+            if filename == '-':
+                raise ValueError('zip archives cannot be written to stdout')
+
+            self.archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+
+        elif filename == '-':
+            out = getattr(sys.stdout, 'buffer', sys.stdout)
+            self.archive = tarfile.open(fileobj=out, mode=self.STREAM_FORMATS[format])
+
+        else:
+            self.archive = tarfile.open(filename, self.FORMATS[format])
+
+    @staticmethod
+    def guess_format(filename):
+        name = filename.lower()
+
+        if name.endswith('.zip'):
+            return 'zip'
+        if name.endswith('.tar.gz') or name.endswith('.tgz'):
+            return 'tgz'
+        if name.endswith('.tar.bz2') or name.endswith('.tbz2'):
+            return 'tbz2'
+
+        return 'tar'
+
+    def add(self, name, data):
+        import tarfile
+        import zipfile
+
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(name, time.localtime(self.mtime)[0:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self.archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self.mtime
+            info.mode = 0o644
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def expand_sources(sources, manifest=None):
+    import glob
+
+    images = []
+
+    if manifest is not None:
+        with open(manifest, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    sources.append(line)
+
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.dsk'):
+                        images.append(os.path.join(root, name))
+
+        elif glob.has_magic(source):
+            images.extend(sorted(glob.glob(source)))
+
+        else:
+            images.append(source)
+
+    return images
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--no-mmap', action='store_true', help='read disk images in a single read instead of mapping them')
+    parser.add_argument('--cache-dir', type=str, default=os.environ.get('FTDOS_CACHE_DIR'), help='catalog cache directory (FTDOS_CACHE_DIR)')
+    parser.add_argument('--cache-size', type=int, default=64, help='catalog cache size limit (MB)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the catalog cache')
+
+
+def open_cache(args):
+    if args.no_cache or not args.cache_dir:
+        return None
+
+    return FTDOS_Cache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+
+def trim_cache(cache):
+    # Chaque processus n'estime que ses propres ecritures dans le cache: la
+    # limite de taille est appliquee une derniere fois une fois le pool arrete
+    if cache is not None:
+        cache.evict()
+
+
+def add_jobs_argument(parser):
+    # multiprocessing n'est charge que par les commandes multi-images
+    import multiprocessing
+
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(), help='number of worker processes')
+
+
+def add_selection_arguments(parser):
+    parser.add_argument('--regex', '-e', type=str, action='append', default=[], help='select files whose name matches REGEX (repeatable)')
+    parser.add_argument('--ext', type=str, action='append', default=[], help='select files with this extension (repeatable)')
+    parser.add_argument('--type', type=str, action='append', default=[], help='select files with this FT-DOS type (repeatable)')
+    parser.add_argument('--content-type', type=str, action='append', default=[], choices=FTDOS_Selector.CONTENT_TYPES, help='select files with this content type (repeatable)')
+    parser.add_argument('--min-size', type=int, default=None, help='minimum file size (sectors)')
+    parser.add_argument('--max-size', type=int, default=None, help='maximum file size (sectors)')
+
+
+def open_selector(args, patterns):
+    # None si aucun critere de selection n'est indique
+    if not (patterns or args.regex or args.ext or args.type or args.content_type or args.min_size is not None or args.max_size is not None):
+        return None
+
+    return FTDOS_Selector(patterns, args.regex, args.ext, args.type, args.content_type, args.min_size, args.max_size)
+
+
+def image_prefixes(images):
+    # Un nom distinct par image: nom du fichier sans extension, suffixe -2,
+    # -3... en cas de doublon
+    prefixes = []
+    used = set()
+
+    for diskname in images:
+        name = os.path.splitext(os.path.basename(diskname))[0]
+        prefix = name
+        n = 1
+        while prefix in used:
+            n += 1
+            prefix = '%s-%d' % (name, n)
+
+        used.add(prefix)
+        prefixes.append(prefix)
+
+    return prefixes
+
+
+def cache_options(cache):
+    # Parametres du cache transmis aux processus, chacun ouvre son FTDOS_Cache
+    return {'cache_dir': cache.directory if cache is not None else None,
+            'cache_size': cache.max_size if cache is not None else None}
+
+
+def open_job_cache(job):
+    # Copie du job ou cache_dir et cache_size (cache_options) sont remplaces
+    # par le FTDOS_Cache correspondant
+    job = dict(job)
+    cache_dir = job.pop('cache_dir')
+    cache_size = job.pop('cache_size')
+
+    job['cache'] = FTDOS_Cache(cache_dir, cache_size) if cache_dir is not None else None
+
+    return job
+
+
+def run_jobs(worker, jobs, processes, ordered=False):
+    # Resultats de worker(job) pour chaque job, calcules par un pool de
+    # processus s'il y a plusieurs images et plusieurs processus. Les
+    # resultats arrivent dans l'ordre de fin de traitement, ou dans l'ordre
+    # des jobs avec ordered.
+    #
+    # Si le parcours est interrompu (Ctrl-C, erreur d'ecriture, generateur
+    # ferme) le pool est arrete sans attendre les images restantes.
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield worker(job)
+        return
+
+    import multiprocessing
+    import itertools
+    import collections
+
+    pool = multiprocessing.Pool(processes)
+    pending = collections.deque()
+    complete = False
+    try:
+        if ordered:
+            # Fenetre glissante: au plus deux images par processus sont en
+            # cours ou en attente de lecture, les resultats ne s'accumulent
+            # pas si l'appelant est plus lent que les processus
+            jobs = iter(jobs)
+            pending.extend([pool.apply_async(worker, (job,)) for job in itertools.islice(jobs, processes * 2)])
+
+            while pending:
+                result = pending.popleft().get()
+                pending.extend([pool.apply_async(worker, (job,)) for job in itertools.islice(jobs, 1)])
+                yield result
+
+        else:
+            for result in pool.imap_unordered(worker, jobs, chunksize=max(1, min(16, len(jobs) // (processes * 4)))):
+                yield result
+
+        complete = True
+
+    finally:
+        if complete:
+            pool.close()
+        else:
+            try:
+                # Un processus arrete pendant l'envoi d'un resultat volumineux
+                # garde le verrou de la file des resultats et bloque
+                # terminate() (Python 2): les images de la fenetre en cours
+                # sont terminees avant l'arret du pool
+                for result in pending:
+                    while not result.ready():
+                        result.wait(0.1)
+            finally:
+                pool.terminate()
+
+        pool.join()
+
+
+def _verify_worker(job):
+    try:
+        return verify_image(**job)
+
+    except Exception as e:
+        return {'image': job['diskname'], 'status': 'error', 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+
+def _export_worker(job):
+    try:
+        job = open_job_cache(job)
+        prefix = job.pop('prefix')
+
+        files = [(prefix + '/' + _text(name), data) for name, data in iter_image_files(**job)]
+        return {'image': job['diskname'], 'status': 'ok', 'files': files}
+
+    except Exception as e:
+        return {'image': job['diskname'], 'status': 'error', 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+
+def _diff_worker(job):
+    try:
+        job = open_job_cache(job)
+        return diff_image(**job)
+
+    except Exception as e:
+        return {'image': job['diskname'], 'status': 'error', 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+
+def _batch_worker(job):
+    try:
+        job = open_job_cache(job)
+        store_dir = job.pop('store_dir')
+
+        if job.pop('stats'):
+            job['stats'] = FTDOS_Stats()
+
+        if store_dir is not None:
+            job['store'] = FTDOS_Store(store_dir)
+
+        return extract_image(**job)
+
+    except Exception as e:
+        return {'image': job['diskname'], 'status': 'error', 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+
+def batch_main(argv):
+    import json
+
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' batch', description='Extraction par lot de plusieurs images FTDOS', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('sources', type=str, nargs='*', default=[], help='disk images, directories or globs')
+    parser.add_argument('--manifest', '-m', type=str, default=None, help='file with one disk image per line')
+    parser.add_argument('--file', '-f', type=str, action='append', default=[], help='file(s) to extract (repeatable, default: all)')
+    parser.add_argument('--header', type=str, default=None, choices=['orix', 'tape'], help='prepend extracted file with header')
+    parser.add_argument('--output', '-o', type=str, default='.', help='output directory')
+    add_jobs_argument(parser)
+    parser.add_argument('--summary', type=str, default=None, help='JSON summary file (default: OUTPUT/summary.json)')
+    parser.add_argument('--system', action='store_true', help='also extract BOOTSECT.BIN and FTDOS3-2.SYS')
+    parser.add_argument('--dedup', action='store_true', help='store each distinct file once in OUTPUT/objects and write OUTPUT/manifest.json')
+    parser.add_argument('--stats', action='store_true', help='add counters and phase timings to the summary')
+    add_selection_arguments(parser)
+    parser.add_argument('--queue-depth', type=int, default=8, help='files read ahead of the writer thread (0: no pipeline)')
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    cache = open_cache(args)
+
+    selector = open_selector(args, args.file) or FTDOS_Selector()
+
+    images = expand_sources(args.sources, args.manifest)
+    if not images:
+        parser.error('no disk image found')
+
+    # Un repertoire de sortie par image
+    jobs = []
+    for diskname, prefix in zip(images, image_prefixes(images)):
+        outdir = os.path.join(args.output, prefix)
+
+        job = {'diskname': diskname,
+               'outdir': outdir,
+               'selector': selector,
+               'header': args.header,
+               'use_mmap': not args.no_mmap,
+               'system': args.system,
+               'depth': args.queue_depth,
+               'store_dir': args.output if args.dedup else None,
+               'stats': args.stats
+               }
+        job.update(cache_options(cache))
+        jobs.append(job)
+
+    results = list(run_jobs(_batch_worker, jobs, args.jobs))
+    trim_cache(cache)
+
+    results.sort(key=lambda r: r['image'])
+    failed = [r for r in results if r['status'] != 'ok']
+
+    for r in failed:
+        eprint('%s: %s' % (r['image'], r['error']))
+
+    summary = {'images': len(results), 'ok': len(results) - len(failed), 'failed': len(failed), 'results': results}
+
+    if args.stats:
+        # Cumul des mesures de toutes les images
+        stats = FTDOS_Stats()
+        for r in results:
+            if 'stats' in r:
+                stats.merge(r['stats'])
+
+        summary['stats'] = stats.report()
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    if args.dedup:
+        # (image, fichier) -> empreinte du contenu
+        manifest = []
+        stored = set()
+        for r in results:
+            if r['status'] == 'ok':
+                for entry in r['files']:
+                    manifest.append({'image': r['image'], 'file': entry['file'], 'hash': entry['hash'], 'size': entry['size']})
+                    stored.add((entry['hash'], entry['size']))
+
+        summary['files'] = len(manifest)
+        summary['unique'] = len(stored)
+        summary['bytes'] = sum([entry['size'] for entry in manifest])
+        summary['stored_bytes'] = sum([size for key, size in stored])
+
+        with open(os.path.join(args.output, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    summary_file = args.summary or os.path.join(args.output, 'summary.json')
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+def verify_main(argv):
+    import json
+
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' verify', description='Controle de l\'integrite des images FTDOS', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('sources', type=str, nargs='*', default=[], help='disk images, directories or globs')
+    parser.add_argument('--manifest', '-m', type=str, default=None, help='file with one disk image per line')
+    parser.add_argument('--output', '-o', type=str, default='-', help='report file, one JSON object per image and per line (-: stdout)')
+    add_jobs_argument(parser)
+    parser.add_argument('--damaged-only', action='store_true', help='only report damaged, invalid or unreadable images')
+    parser.add_argument('--no-mmap', action='store_true', help='read disk images in a single read instead of mapping them')
+
+    args = parser.parse_args(argv)
+
+    images = expand_sources(args.sources, args.manifest)
+    if not images:
+        parser.error('no disk image found')
+
+    jobs = [{'diskname': diskname, 'use_mmap': not args.no_mmap} for diskname in images]
+
+    results = run_jobs(_verify_worker, jobs, args.jobs)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    # Les rapports sont ecrits au fur et a mesure
+    counts = {}
+    try:
+        for report in results:
+            counts[report['status']] = counts.get(report['status'], 0) + 1
+
+            if args.damaged_only and report['status'] == 'ok':
+                continue
+
+            output.write(json.dumps(report, sort_keys=True) + '\n')
+            output.flush()
+
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+        results.close()
+
+    eprint(', '.join(['%s: %d' % (status, n) for status, n in sorted(counts.items())]))
+
+    return 0 if counts.get('ok', 0) == len(jobs) else 1
+
+
+def export_main(argv):
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' export', description='Export des fichiers de plusieurs images FTDOS dans une archive tar ou zip', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('sources', type=str, nargs='*', default=[], help='disk images, directories or globs')
+    parser.add_argument('--manifest', '-m', type=str, default=None, help='file with one disk image per line')
+    parser.add_argument('--output', '-o', type=str, required=True, help='archive file (-: tar stream on stdout)')
+    parser.add_argument('--format', type=str, default=None, choices=sorted(FTDOS_Archive.FORMATS.keys()), help='archive format (default: from the output file name)')
+    parser.add_argument('--file', '-f', type=str, action='append', default=[], help='file(s) to export (repeatable, default: all)')
+    parser.add_argument('--header', type=str, default=None, choices=['orix', 'tape'], help='prepend exported files with header')
+    parser.add_argument('--system', action='store_true', help='also export BOOTSECT.BIN and FTDOS3-2.SYS')
+    add_jobs_argument(parser)
+    add_selection_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    cache = open_cache(args)
+
+    images = expand_sources(args.sources, args.manifest)
+    if not images:
+        parser.error('no disk image found')
+
+    # Les fichiers de chaque image sont ranges sous un prefixe distinct
+    jobs = []
+    for diskname, prefix in zip(images, image_prefixes(images)):
+        job = {'diskname': diskname,
+               'prefix': prefix,
+               'selector': open_selector(args, args.file),
+               'header': args.header,
+               'system': args.system,
+               'use_mmap': not args.no_mmap
+               }
+        job.update(cache_options(cache))
+        jobs.append(job)
+
+    # Lecture des images en parallele, ecriture de l'archive dans l'ordre
+    results = run_jobs(_export_worker, jobs, args.jobs, ordered=True)
+
+    images = 0
+    files = 0
+    failed = 0
+    try:
+        with FTDOS_Archive(args.output, args.format) as archive:
+            for r in results:
+                if r['status'] != 'ok':
+                    eprint('%s: %s' % (r['image'], r['error']))
+                    failed += 1
+                    continue
+
+                for name, data in r['files']:
+                    archive.add(name, data)
+
+                images += 1
+                files += len(r['files'])
+
+    finally:
+        results.close()
+        trim_cache(cache)
+
+    eprint('%d image(s), %d file(s) exported, %d failed' % (images, files, failed))
+
+    return 1 if failed else 0
+
+
+def mount_main(argv):
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' mount', description='Montage en lecture seule d\'une image FTDOS (FUSE)', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('diskname', type=str, help='Disk image file')
+    parser.add_argument('mountpoint', type=str, help='mount point')
+    parser.add_argument('--system', action='store_true', help='also show BOOTSECT.BIN and FTDOS3-2.SYS')
+    parser.add_argument('--no-headers', action='store_true', help='do not show the .orix and .tape header views')
+    parser.add_argument('--background', action='store_true', help='detach from the terminal')
+    parser.add_argument('--no-mmap', action='store_true', help='read the disk image in a single read instead of mapping it')
+
+    args = parser.parse_args(argv)
+
+    from .vfs import FTDOS_VFS, HEADERS, mount
+
+    fs = ftdos(args.diskname, use_mmap=not args.no_mmap)
+    if fs.validate(args.diskname) is None:
+        eprint("Invalid disk image")
+        return 1
+
+    try:
+        mount(FTDOS_VFS(fs, () if args.no_headers else HEADERS, args.system), args.mountpoint, not args.background)
+    except ImportError as e:
+        eprint(e)
+        return 1
+    finally:
+        fs.close()
+
+    return 0
+
+
+def address(value):
+    # Adresse decimale ou hexadecimale: 0x1000, $1000, #1000
+    if value[:1] in ('$', '#'):
+        value = '0x' + value[1:]
+
+    try:
+        return int(value, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid address: %r' % value)
+
+
+def index_main(argv):
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' index', description='Indexation des catalogues d\'images FTDOS dans une base SQLite', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('database', type=str, help='SQLite database file')
+    parser.add_argument('sources', type=str, nargs='*', default=[], help='disk images, directories or globs')
+    parser.add_argument('--manifest', '-m', type=str, default=None, help='file with one disk image per line')
+    add_jobs_argument(parser)
+    parser.add_argument('--prune', action='store_true', help='remove images that no longer exist from the database')
+    parser.add_argument('--no-mmap', action='store_true', help='read disk images in a single read instead of mapping them')
+
+    args = parser.parse_args(argv)
+
+    from .database import FTDOS_Database, index_image
+
+    images = expand_sources(args.sources, args.manifest)
+    if not images and not args.prune:
+        parser.error('no disk image found')
+
+    counts = {}
+    with FTDOS_Database(args.database) as db:
+        # Seules les images nouvelles ou modifiees (taille, date) sont relues
+        jobs = db.jobs(images, not args.no_mmap)
+        counts['skipped'] = len(images) - len(jobs)
+
+        results = run_jobs(index_image, jobs, args.jobs)
+
+        try:
+            for result in results:
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                if result['status'] == 'error':
+                    eprint('%s: %s' % (result['path'], result['error']))
+
+                db.store(result)
+
+            if args.prune:
+                counts['pruned'] = db.prune()
+
+            db.commit()
+
+        finally:
+            results.close()
+
+    eprint(', '.join(['%s: %d' % (status, n) for status, n in sorted(counts.items())]))
+
+    return 1 if counts.get('error', 0) else 0
+
+
+def query_main(argv):
+    import json
+
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' query', description='Recherche de fichiers dans une base d\'images FTDOS', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('database', type=str, help='SQLite database file (see index)')
+    parser.add_argument('patterns', type=str, nargs='*', default=[], help='file name patterns (NAME.EXT, wildcards allowed)')
+    parser.add_argument('--address', type=address, default=None, help='select files loaded over this address')
+    parser.add_argument('--exec', type=address, default=None, dest='exec_addr', help='select files with this execution address')
+    parser.add_argument('--hash', type=str, default=None, help='select files with this SHA-1')
+    parser.add_argument('--volume', type=str, default=None, help='select images whose volume name matches this pattern')
+    parser.add_argument('--json', action='store_true', help='one JSON object per file')
+    add_selection_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.database):
+        parser.error('%s: no such database' % args.database)
+
+    from .database import FTDOS_Database
+
+    with FTDOS_Database(args.database) as db:
+        rows = db.query(args.patterns, args.regex, args.ext, args.type, args.content_type, args.min_size, args.max_size,
+                        args.address, args.exec_addr, args.hash.lower() if args.hash else None, args.volume)
+
+    for row in rows:
+        if args.json:
+            line = json.dumps(row, sort_keys=True)
+        elif row['error']:
+            line = '%s: %s %s %s (%s)' % (row['image'], row['volume'], row['stripped_name'], row['type'], row['error'])
+        else:
+            line = '%s: %s %-12s %s %3d $%04X-$%04X $%04X %s' % (row['image'], row['volume'], row['stripped_name'], row['type'], row['sectors'],
+                                                                  row['start'], row['end'], row['exec'], row['sha1'])
+
+        if sys.version_info[0] < 3 and isinstance(line, unicode):
+            line = line.encode('utf-8')
+
+        print(line)
+
+    return 0 if rows else 1
+
+
+def format_diff(report):
+    # Rapport de diff_image() lisible
+    if report['status'] in ('error', 'invalid'):
+        return ['%s: %s' % (report['image'], report.get('error', report['status']))]
+
+    sectors = report['sectors']
+    lines = ['%s: %s, %d changed, %d missing, %d added sector(s)' % (report['image'], report['status'], len(sectors['changed']), len(sectors['missing']), len(sectors['added']))]
+
+    for kind in ('changed', 'moved', 'added', 'removed'):
+        if report['files'][kind]:
+            lines.append('  files %s: %s' % (kind, ', '.join(report['files'][kind])))
+
+    for region in ('boot', 'system', 'bitmap', 'catalog'):
+        if region in report['regions']:
+            lines.append('  %s: %s' % (region, ' '.join(['%d:%d/%d' % tuple(key) for key in report['regions'][region]])))
+
+    if report['unallocated']:
+        lines.append('  unallocated: %s' % ' '.join(['%d:%d/%d' % tuple(key) for key in report['unallocated']]))
+
+    return lines
+
+
+def diff_main(argv):
+    import json
+
+    parser = argparse.ArgumentParser(prog=__program_name__ + ' diff', description='Comparaison d\'images FTDOS a une image de reference, secteur par secteur', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('reference', type=str, help='reference disk image')
+    parser.add_argument('sources', type=str, nargs='*', default=[], help='disk images, directories or globs')
+    parser.add_argument('--manifest', '-m', type=str, default=None, help='file with one disk image per line')
+    parser.add_argument('--output', '-o', type=str, default='-', help='report file (-: stdout)')
+    parser.add_argument('--json', action='store_true', help='one JSON object per image and per line')
+    add_jobs_argument(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    cache = open_cache(args)
+
+    images = [diskname for diskname in expand_sources(args.sources, args.manifest) if os.path.abspath(diskname) != os.path.abspath(args.reference)]
+    if not images:
+        parser.error('no disk image found')
+
+    # La reference n'est analysee qu'une fois, sa signature est transmise
+    # a chaque processus
+    try:
+        reference = image_signature(args.reference, not args.no_mmap, cache)
+    except Exception as e:
+        eprint('%s: %s' % (args.reference, e))
+        return 1
+
+    jobs = []
+    for diskname in images:
+        job = {'reference': reference,
+               'diskname': diskname,
+               'use_mmap': not args.no_mmap
+               }
+        job.update(cache_options(cache))
+        jobs.append(job)
+
+    # Rapports dans l'ordre des images
+    results = run_jobs(_diff_worker, jobs, args.jobs, ordered=True)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    counts = {}
+    try:
+        for report in results:
+            counts[report['status']] = counts.get(report['status'], 0) + 1
+
+            lines = [json.dumps(report, sort_keys=True)] if args.json else format_diff(report)
+            output.write(''.join([line + '\n' for line in lines]))
+            output.flush()
+
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+        results.close()
+        trim_cache(cache)
+
+    eprint(', '.join(['%s: %d' % (status, n) for status, n in sorted(counts.items())]))
+
+    return 0 if counts.get('identical', 0) == len(jobs) else 1
+
+
+COMMANDS = {'batch': batch_main, 'verify': verify_main, 'export': export_main, 'mount': mount_main, 'index': index_main, 'query': query_main, 'diff': diff_main}
+
+
+def dump_spec(spec):
+    # 'image', [face:]piste ou [face:]piste/secteur
+    # -> (quoi, face, piste, secteur)
+    if spec == 'image':
+        return ('image', 0, None, None)
+
+    m = re.match(r'^(?:(\d+):)?(\d+)(?:/(\d+))?$', spec)
+    if m is None:
+        raise argparse.ArgumentTypeError("invalid dump '%s'" % spec)
+
+    side, track, sector = [int(v) if v is not None else None for v in m.groups()]
+
+    return ('track' if sector is None else 'sector', side or 0, track, sector)
+
+
+def write_stats(stats, filename):
+    # Rapport JSON des compteurs, '-': sortie d'erreur
+    import json
+
+    report = json.dumps(stats.report(), indent=2, sort_keys=True)
+
+    if filename == '-':
+        eprint(report)
+    else:
+        with open(filename, 'w') as f:
+            f.write(report + '\n')
+
+
+def write_profile(profiler, filename):
+    # Profil cProfile: fichier pstats, ou resume sur la sortie d'erreur
+    if filename == '-':
+        import pstats
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    else:
+        profiler.dump_stats(filename)
+
+
+# ------------------------------------------------------------------------------
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(prog=__program_name__, description=__description__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('diskname', type=str, help='Disk image file')
+    parser.add_argument('file', type=str, nargs='*', default=[], help='file(s) to extract')
+    parser.add_argument('--header', type=str, default=None, choices=['orix', 'tape'], help='prepend extracted file with header')
+    parser.add_argument('--usage', action='store_true', help='print disk usage report (JSON)')
+    parser.add_argument('--unsorted', action='store_true', help='list the catalog in disk order, while it is read')
+    parser.add_argument('--hexdump', type=dump_spec, default=None, metavar='WHAT', help="hexdump 'image', a track ([SIDE:]TRACK) or a sector ([SIDE:]TRACK/SECTOR)")
+    parser.add_argument('--stats', type=str, nargs='?', const='-', default=None, metavar='FILE', help='write counters and phase timings as JSON (default: stderr)')
+    parser.add_argument('--profile', type=str, default=None, metavar='FILE', help='run under cProfile and write the pstats to FILE (-: summary on stderr)')
+    add_selection_arguments(parser)
+    parser.add_argument('--verbose', '-v', action='count', default=0, help='increase verbosity')
+    parser.add_argument('--version', '-V', action='version', version='%%(prog)s v%s' % __version__)
+    parser.add_argument('--queue-depth', type=int, default=8, help='files read ahead of the writer thread (0: no pipeline)')
+    add_cache_arguments(parser)
+
+    args = parser.parse_args()
+
+    stats = FTDOS_Stats() if args.stats is not None else None
+
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        with stats.timer('total') if stats is not None else NO_TIMER:
+            ret = run(args, stats)
+
+    except FTDOS_SectorError as e:
+        # Image endommagee: catalogue ou FCB boucle, hors geometrie ou absent
+        eprint('%s: %s' % (args.diskname, e))
+        ret = 1
+
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            write_profile(profiler, args.profile)
+
+        if stats is not None:
+            write_stats(stats, args.stats)
+
+    if ret:
+        sys.exit(ret)
+
+
+def run(args, stats=None):
+    fs = ftdos(args.diskname, args.verbose, open_cache(args), not args.no_mmap, stats)
+    img_params = fs.validate(args.diskname)
+
+    if img_params is None:
+        eprint("Invalid disk image")
+        return 1
+
+    fs.read_diskname()
+
+    if args.verbose > 0:
+        print('')
+        print(args.diskname, ':')
+        print('\tImage header')
+        print('')
+        print('Signature: ', fs.signature)
+        print('DOS      : ', fs.dos)
+        print('Faces    : ', fs.sides)
+        print('Pistes   : ', fs.tracks)
+        print('Secteurs : ', fs.sectors)
+        print('Geometrie: ', fs.geometry)
+        print('Offset   : ', fs.offset)
+        print('')
+
+    if fs.dos == 'FT-Dos':
+
+        # Le catalogue n'est lu en entier que si necessaire
+        selector = open_selector(args, args.file)
+
+        if args.verbose > 1:
+            print('')
+            print('\tDisk informations')
+            print('')
+            fs.display_bitmap()
+            print('')
+
+        if args.verbose > 2:
+            print('')
+            pprint(fs.read_dir().as_dict())
+            print('')
+
+        if args.hexdump is not None:
+            what, side, track, sector = args.hexdump
+
+            if what == 'image':
+                fs.dump_image(sys.stdout)
+            elif what == 'track':
+                fs.dump_track(sys.stdout, track, side)
+            else:
+                fs.dump_sector(sys.stdout, track, sector, side)
+
+        elif args.usage:
+            import json
+
+            report = fs.usage()
+            report['files'] = dict([(_text(fn), v) for fn, v in report['files'].items()])
+            print(json.dumps(report, indent=2, sort_keys=True))
+
+        elif selector is None:
+            print('')
+            print('\tDisk Catalog')
+            print('')
+            print('   VOLUME : %s (%s)' % (fs.diskname, fs.disktype))
+            print('')
+            fs._cat(not args.unsorted)
+            print('')
+
+        else:
+            selected = [(entry.name, entry.stripped_name) for entry in fs.select(selector)]
+            extract_files(fs, selected, '.', args.header, args.queue_depth)
+
+    else:
+        eprint("Unknown DOS: ", fs.dos)
+        return 2
+
+    return 0
+
@@ -0,0 +1,2293 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: core.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.4 $
+#
+# Lecture des images FTDOS, sans les dependances de la ligne de commande
+# (voir cli.py).
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import os
+import io
+import itertools
+import bisect
+
+import sys
+import struct
+import mmap
+import re
+import binascii
+import hashlib
+import timeit
+
+from collections import OrderedDict, namedtuple
+
+# Analyseur MFM compile (_ftdos_mfm.c), optionnel
+try:
+    from . import _ftdos_mfm
+except ImportError:
+    _ftdos_mfm = None
+
+# ------------------------------------------------------------------------------
+__program_name__ = 'ftdos'
+__description__ = "Gestion des images FTDOS"
+__plugin_type__ = "OS"
+__version__ = 0.2
+
+# Droits des fichiers du cache et du stockage: ceux d'un open() ordinaire,
+# mkstemp() cree ses fichiers en 0600. Le masque est lu une seule fois,
+# os.umask() ne permet pas de le lire sans le modifier.
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# numpy est optionnel et long a importer: il n'est charge qu'au premier
+# decodage du bitmap
+_numpy = False
+
+
+def load_numpy():
+    global _numpy
+
+    if _numpy is False:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+
+    return _numpy
+
+
+# ------------------------------------------------------------------------------
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Marques d'adresse MFM: ID (0xFE) et donnees (0xFB)
+ID_MARK = b'\xfe'
+DATA_MARK = re.compile(b'[\xfb\xfe]')
+
+# Etat du CRC-CCITT apres les 3 octets de synchronisation A1
+CRC_SYNC = binascii.crc_hqx(b'\xa1\xa1\xa1', 0xffff)
+
+
+FILTER = ''.join([(len(repr(chr(x))) == 3) and chr(x) or '.' for x in range(256)])
+
+
+# Representation hexadecimale de chaque octet
+HEX = ['%02X' % x for x in range(256)]
+
+
+def dump_lines(src, offset=0, length=16):
+    # Lignes du dump hexadecimal de src (chaine, mmap ou memoryview). Seules
+    # les tranches de length octets sont copiees: le temps est lineaire quelle
+    # que soit la taille de src.
+    width = length * 3
+
+    for pos in range(0, len(src), length):
+        s = src[pos:pos + length]
+        if isinstance(s, memoryview):
+            s = s.tobytes()
+
+        hexa = ' '.join([HEX[x] for x in bytearray(s)])
+        yield "%04X   %-*s   %s\n" % (pos + offset, width, hexa, s.translate(FILTER))
+
+
+def dump_to(stream, src, offset=0, length=16, batch=512):
+    # Dump hexadecimal ecrit dans stream par paquets de batch lignes
+    lines = []
+
+    for line in dump_lines(src, offset, length):
+        lines.append(line)
+
+        if len(lines) == batch:
+            stream.write(''.join(lines))
+            lines = []
+
+    if lines:
+        stream.write(''.join(lines))
+
+
+def dump(src, offset=0, length=16):
+    return ''.join(dump_lines(src, offset, length))
+
+
+# ------------------------------------------------------------------------------
+class SectorLoc(namedtuple('SectorLoc', 'id_ptr data_ptr size id_crc data_crc')):
+    # Position d'un secteur dans l'image (valeurs de l'index des secteurs)
+    #   id_ptr  : marque d'ID (0xFE)
+    #   data_ptr: premier octet de donnees
+    #   size    : code de taille (256 octets pour 1)
+    #   id_crc, data_crc: CRC corrects
+    #
+    # Dans read_track() les offsets sont relatifs a la piste et data_ptr
+    # pointe sur la marque 0xFB, comme dans l'ancien dictionnaire.
+    # L'acces par nom (loc['data_ptr']) reste possible.
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+
+        return tuple.__getitem__(self, key)
+
+
+class FTDOS_SectorError(ValueError):
+    # Secteur absent de l'image, hors de la geometrie du disque ou deja
+    # rencontre dans une chaine (catalogue, FCB)
+    def __init__(self, kind, track, sector, side=0):
+        ValueError.__init__(self, '%s sector S:%d P:%02d S:%02d' % (kind, side, track, sector))
+        self.kind = kind
+        self.side = side
+        self.track = track
+        self.sector = sector
+
+    def as_dict(self):
+        return {'kind': self.kind, 'side': self.side, 'track': self.track, 'sector': self.sector}
+
+
+class FileExtent(namedtuple('FileExtent', 'offset side track sector length')):
+    # Secteur de donnees d'un fichier: position dans le fichier (offset) et
+    # emplacement sur le disque
+    __slots__ = ()
+
+
+class DirEntry(object):
+    # Entree du catalogue FT-DOS
+    __slots__ = ('name', 'stripped_name', 'side', 'track', 'sector', 'lock', 'type', 'size', 'content_type')
+
+    FIELDS = ('stripped_name', 'side', 'track', 'sector', 'lock', 'type', 'size', 'content_type')
+
+    def __init__(self, name, stripped_name, side, track, sector, lock, type, size, content_type):
+        self.name = name
+        self.stripped_name = stripped_name
+        self.side = side
+        self.track = track
+        self.sector = sector
+        self.lock = lock
+        self.type = type
+        self.size = size
+        self.content_type = content_type
+
+    # Compatibilite avec l'ancien dictionnaire: entry['track']
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    @property
+    def ext(self):
+        return self.name[9:12].rstrip()
+
+    def keys(self):
+        return list(self.FIELDS)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def as_dict(self):
+        return dict([(key, getattr(self, key)) for key in self.FIELDS])
+
+    def __getstate__(self):
+        return tuple([getattr(self, key) for key in self.__slots__])
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    def __eq__(self, other):
+        return isinstance(other, DirEntry) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'DirEntry(%r, %r)' % (self.name, self.as_dict())
+
+
+class FTDOS_Catalog(dict):
+    # Catalogue: nom -> DirEntry, avec un acces par premier FCB
+    def __init__(self, entries=()):
+        dict.__init__(self)
+        self._locations = {}
+        self._groups = None
+
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        self[entry.name] = entry
+
+    def __setitem__(self, name, entry):
+        if name in self:
+            self._locations.pop((self[name].side, self[name].track, self[name].sector), None)
+
+        dict.__setitem__(self, name, entry)
+        self._locations[(entry.side, entry.track, entry.sector)] = entry
+        self._groups = None
+
+    def __delitem__(self, name):
+        entry = self[name]
+        dict.__delitem__(self, name)
+        self._locations.pop((entry.side, entry.track, entry.sector), None)
+        self._groups = None
+
+    def by_location(self, track, sector, side=0):
+        # Entree dont le premier FCB est en (face, piste, secteur)
+        return self._locations.get((side, track, sector))
+
+    def by_name(self, name):
+        # Nom complet ('NOM     .EXT') ou nom reduit ('NOM.EXT')
+        if name in self:
+            return self[name]
+
+        for entry in self.values():
+            if entry.stripped_name == name:
+                return entry
+
+        return None
+
+    def _index(self):
+        # Entrees regroupees par extension et par type de contenu, construit
+        # a la premiere recherche
+        if self._groups is None:
+            extensions = {}
+            content_types = {}
+
+            for entry in self.values():
+                extensions.setdefault(entry.ext.upper(), []).append(entry)
+                content_types.setdefault(entry.content_type, []).append(entry)
+
+            self._groups = (extensions, content_types)
+
+        return self._groups
+
+    def by_extension(self, ext):
+        return list(self._index()[0].get(ext.upper(), []))
+
+    def by_content_type(self, content_type):
+        return list(self._index()[1].get(content_type, []))
+
+    def copy(self):
+        return FTDOS_Catalog(self.values())
+
+    def as_dict(self):
+        return dict([(name, entry.as_dict()) for name, entry in self.items()])
+
+    def __reduce__(self):
+        return (FTDOS_Catalog, (list(self.values()),))
+
+
+# Caracteres generiques des motifs shell (glob.has_magic)
+MAGIC = re.compile('[*?[]')
+
+
+class FTDOS_Selector():
+    # Selection de fichiers: motifs shell et expressions regulieres sur le nom
+    # reduit ('NOM.EXT'), regroupes dans une seule expression reguliere, et
+    # filtres sur l'extension, le type, le type de contenu et la taille (en
+    # secteurs). Un fichier est retenu si son nom correspond a l'un des
+    # motifs (ou s'il n'y a aucun motif) et s'il passe tous les filtres.
+    CONTENT_TYPES = ('basic', 'asm', 'array', 'lscreen', 'hscreen', 'data', 'text', '???')
+
+    def __init__(self, patterns=(), regex=(), extensions=(), types=(), content_types=(), min_size=None, max_size=None):
+        import fnmatch
+
+        names = ['(?:%s)' % fnmatch.translate(pattern) for pattern in patterns]
+        names.extend(['(?:.*?(?:%s))' % r for r in regex])
+
+        self.names = re.compile('|'.join(names), re.IGNORECASE) if names else None
+        self.patterns = list(patterns)
+        self.regex = list(regex)
+        self.extensions = set([ext.upper() for ext in extensions])
+        self.types = set([t.upper() for t in types])
+        self.content_types = set(content_types)
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def match(self, entry):
+        if self.extensions and entry.ext.upper() not in self.extensions:
+            return False
+
+        if self.content_types and entry.content_type not in self.content_types:
+            return False
+
+        if self.types and entry.type.upper() not in self.types:
+            return False
+
+        if self.min_size is not None and entry.size < self.min_size:
+            return False
+
+        if self.max_size is not None and entry.size > self.max_size:
+            return False
+
+        return self.names is None or self.names.match(entry.stripped_name) is not None
+
+    def literal_names(self):
+        # Noms recherches si la selection se limite a des noms sans
+        # caractere generique, None sinon
+        if self.names is None or self.regex or self.extensions or self.types or self.content_types or self.min_size is not None or self.max_size is not None:
+            return None
+
+        if [pattern for pattern in self.patterns if MAGIC.search(pattern)]:
+            return None
+
+        return [pattern.upper() for pattern in self.patterns]
+
+    def select(self, catalog):
+        # Entrees retenues, triees par nom. Les filtres sur l'extension et
+        # le type de contenu passent par l'index du catalogue.
+        if self.extensions or self.content_types:
+            candidates = None
+
+            if self.extensions:
+                candidates = dict([(entry.name, entry) for ext in self.extensions for entry in catalog.by_extension(ext)])
+
+            if self.content_types:
+                entries = dict([(entry.name, entry) for ct in self.content_types for entry in catalog.by_content_type(ct)])
+                if candidates is None:
+                    candidates = entries
+                else:
+                    candidates = dict([(name, entry) for name, entry in entries.items() if name in candidates])
+
+            candidates = candidates.values()
+        else:
+            candidates = catalog.values()
+
+        return sorted([entry for entry in candidates if self.match(entry)], key=lambda entry: entry.name)
+
+
+# ------------------------------------------------------------------------------
+class ftdos():
+    def __init__(self, source='DEFAULT', verbose=0, cache=None, use_mmap=True, stats=None):
+        # Catalogue, complet une fois le chainage parcouru jusqu'au bout
+        self.dirents = FTDOS_Catalog()
+        self._dir_complete = False
+        self.source = source
+        self.offset = 0
+        self.sides = 2
+        self.tracks = 41
+        self.sectors = 17
+        self.sectorsize = 256
+        self.geometry = 1
+        self.signature = 'MFM_DISK'
+        self.diskname = ''
+        self.dostype = 'FTDOS'
+        self.dos = ''
+        self.disktype = ''
+
+        self.crc = 0
+        self.trackbuf = []
+        self.ptr_track = 0
+        self.diskimg = []
+
+        # Image projetee en memoire et cache LRU des pistes decodees
+        self.tracksize = 6400
+        self.track_cache_size = 32
+        self._image = None
+        self._view = None
+        self._track_cache = OrderedDict()
+        self._index = None
+        self.use_mmap = use_mmap
+        self.accelerated = True
+
+        # Emplacement et contenu du systeme FT-DOS
+        self._sys_track = None
+        self._sys_cache = {}
+
+        # Table des secteurs de chaque fichier: nom -> (extents, offsets)
+        self._extents = {}
+        self._sizes = {}
+
+        # Empreintes des secteurs: (face, piste, secteur) -> sha1
+        self._hashes = None
+
+        # Cache persistant des images deja analysees (FTDOS_Cache)
+        self.cache = cache
+        self._cached = None
+
+        # Compteurs et durees (FTDOS_Stats), None: pas de mesure
+        self.stats = stats
+
+        self.verbose = verbose
+
+    def __enter__(self):
+        return self
+
+    def _timer(self, phase):
+        if self.stats is None:
+            return NO_TIMER
+
+        return self.stats.timer(phase)
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def open_image(self):
+        if self._image is None:
+            with open(self.source, 'rb') as f:
+                if self.use_mmap:
+                    self._image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    # Lecture de l'image complete en une seule fois
+                    self._image = f.read()
+
+            if sys.version_info[0] >= 3:
+                self._view = memoryview(self._image)
+            else:
+                # Python 2: mmap n'implemente pas le nouveau protocole buffer et
+                # les tranches d'un memoryview ne sont pas des chaines, les
+                # tranches sont alors des copies
+                self._view = self._image
+
+        return self._view
+
+    def close(self):
+        self._dir_complete = False
+        self._track_cache.clear()
+        self._index = None
+        self._cached = None
+        self._sys_track = None
+        self._sys_cache = {}
+        self._extents = {}
+        self._sizes = {}
+        self._hashes = None
+
+        if self._image is not None:
+            if isinstance(self._view, memoryview) and hasattr(self._view, 'release'):
+                self._view.release()
+            self._view = None
+
+            try:
+                if isinstance(self._image, mmap.mmap):
+                    self._image.close()
+            except BufferError:
+                # Des tranches de l'image sont encore referencees
+                pass
+
+            self._image = None
+
+    def validate(self, diskimg):
+        with self._timer('validate'):
+            return self._validate(diskimg)
+
+    def _validate(self, diskimg):
+        ret = None
+
+        try:
+            diskimg = os.path.abspath(diskimg)
+
+            if self.cache is not None:
+                state = self.cache.get(diskimg)
+
+                if self.stats is not None:
+                    self.stats.count('catalog_cache_misses' if state is None else 'catalog_cache_hits')
+
+                if state is not None:
+                    self.close()
+                    self.source = diskimg
+                    self._restore(state)
+                    return state['params']
+
+            self.close()
+            self.source = diskimg
+
+            # Une seule ouverture de l'image: en-tete et pistes sont lus dans
+            # le meme tampon
+            image = self.open_image()
+            self.signature = image[0:8]
+
+            if self.signature != 'MFM_DISK':
+                eprint("Erreur signature '%s' incorrecte pour %s" % (self.signature, diskimg))
+                self.close()
+            elif len(image) < 0x100:
+                # Signature correcte mais en-tete incomplet
+                raise ValueError('Image tronquee (%d octets) pour %s' % (len(image), diskimg))
+            else:
+                # Geometrie de l'image, necessaire a l'indexation des secteurs
+                self.offset = 0x100
+                self.sides, self.tracks, self.geometry = struct.unpack('<3L', image[8:20])
+
+                # L'en-tete ne doit pas annoncer plus de pistes que l'image
+                # n'en contient: l'indexation parcourt faces * pistes
+                if self.sides < 1 or self.tracks < 1 or self.offset + self.sides * self.tracks * self.tracksize > len(image):
+                    raise ValueError('Geometrie incorrecte (%d faces, %d pistes) pour %s' % (self.sides, self.tracks, diskimg))
+
+                # print('Lecture 20/1')
+                sector = self.read_sector(20, 1)
+                dos = sector[246:248]
+
+                if dos == chr(0x80) + chr(0x80) or dos == chr(0x80) + chr(0x4d):
+                    # print('Lecture 20/2')
+                    sector = self.read_sector(20, 2)
+                    dos = sector[0:2]
+
+                    if dos == chr(0x00) + chr(0x00):
+
+                        self.dos = 'FT-Dos'
+
+                        self.sectors = len(self.read_track(20, 0)['sectors'])
+                        self.sectorsize = 256
+
+                        ret = {'source': diskimg,
+                                'dos': self.dos,
+                                'sides': self.sides,
+                                'tracks': self.tracks,
+                                'sectors': self.sectors,
+                                'sectorsize': self.sectorsize,
+                                'geometry': self.geometry,
+                                'offset': self.offset
+                            }
+
+                        # self.read_diskname()
+                        # self.read_dir()
+                        # self.loaddisk()
+                    else:
+                        eprint('Echec')
+                        eprint(dump(sector[0:256]))
+                        eprint(dump(dos))
+                else:
+                    eprint('Echec')
+                    eprint(dump(sector[0:256]))
+                    eprint(dump(dos))
+
+        except (IOError, ValueError) as e:
+            # ValueError: image vide, impossible a projeter en memoire
+            eprint(e)
+            self.close()
+            self.source = None
+            ret = None
+
+        return ret
+
+    def build_index(self):
+        # Index des secteurs de l'image:
+        #   (face, piste, secteur) -> (id_ptr, data_ptr, taille, id_crc, data_crc)
+        # id_ptr et data_ptr sont des offsets absolus dans l'image, data_ptr
+        # pointe sur le premier octet de donnees (apres la marque 0xFB)
+        with self._timer('index'):
+            if _ftdos_mfm is not None and self.accelerated:
+                self._index = _ftdos_mfm.scan(self.open_image(), self.offset, self.sides, self.tracks, self.tracksize, SectorLoc)
+            else:
+                self._index = self.build_index_python()
+
+        if self.stats is not None:
+            self.stats.count('tracks_scanned', self.sides * self.tracks)
+            self.stats.count('sectors_decoded', len(self._index))
+
+        return self._index
+
+    def build_index_python(self):
+        index = {}
+
+        image = self.open_image()
+        size = len(image)
+
+        for side in range(0, self.sides):
+            for track in range(0, self.tracks):
+                ptr = self.offset + (side * self.tracks + track) * self.tracksize
+                eot = min(ptr + self.tracksize, size)
+
+                while ptr < eot:
+                    ptr = image.find(ID_MARK, ptr, eot)
+
+                    if ptr < 0 or ptr + 7 > eot:
+                        break
+
+                    id_ptr = ptr
+                    S = ord(image[ptr + 3])
+                    n = ord(image[ptr + 4])
+
+                    id_crc = binascii.crc_hqx(image[ptr:ptr + 5], CRC_SYNC) == struct.unpack('>H', image[ptr + 5:ptr + 7])[0]
+
+                    # skip ID field & crc
+                    mark = DATA_MARK.search(image, ptr + 7, eot)
+                    if mark is None:
+                        break
+
+                    ptr = mark.start()
+                    length = 1 << (n + 7)
+
+                    data_crc = binascii.crc_hqx(image[ptr:ptr + length + 1], CRC_SYNC) == struct.unpack('>H', image[ptr + length + 1:ptr + length + 3].ljust(2, b'\x00'))[0]
+
+                    index[(side, track, S)] = SectorLoc(id_ptr, ptr + 1, n, id_crc, data_crc)
+
+                    # Skip data field and ID
+                    ptr += length + 3
+
+        return index
+
+    def sector_index(self):
+        if self._index is None:
+            self.build_index()
+
+        return self._index
+
+    def read_sector(self, track, sector, side=0):
+        try:
+            id_ptr, data_ptr, n, id_crc, data_crc = self.sector_index()[(side, track, sector)]
+        except KeyError:
+            raise FTDOS_SectorError('missing', track, sector, side)
+
+        if self.stats is not None:
+            self.stats.count('sectors_read')
+            self.stats.count('bytes_read', 1 << (n + 7))
+
+        return self.open_image()[data_ptr:data_ptr + (1 << (n + 7))]
+
+    def read_track(self, track, side):
+        # print('***read_track(%s): Track=%d/%d, Side=%d' % (__name__, track, self.tracks, side))
+        sector = {}
+        read_track = {}
+
+        if self.signature != 'MFM_DISK':
+            return sector
+
+        key = (side, track)
+        if key in self._track_cache:
+            if self.stats is not None:
+                self.stats.count('track_cache_hits')
+
+            read_track = self._track_cache.pop(key)
+            self._track_cache[key] = read_track
+            return read_track
+
+        if self.stats is not None:
+            self.stats.count('track_cache_misses')
+            self.stats.count('tracks_read')
+            self.stats.count('bytes_read', self.tracksize)
+
+        index = self.sector_index()
+
+        ptr = self.offset + (side * self.tracks + track) * self.tracksize
+        read_track['raw'] = self.open_image()[ptr:ptr + self.tracksize]
+
+        for S in range(0, 256):
+            loc = index.get((side, track, S))
+            if loc is not None:
+                sector[S] = SectorLoc(loc.id_ptr - ptr, loc.data_ptr - 1 - ptr, loc.size, loc.id_crc, loc.data_crc)
+
+        read_track['sectors'] = sector
+
+        self._track_cache[key] = read_track
+        if len(self._track_cache) > self.track_cache_size:
+            self._track_cache.popitem(last=False)
+
+        return read_track
+
+    def _cache_state(self):
+        return {'params': {'source': self.source,
+                            'dos': self.dos,
+                            'sides': self.sides,
+                            'tracks': self.tracks,
+                            'sectors': self.sectors,
+                            'sectorsize': self.sectorsize,
+                            'geometry': self.geometry,
+                            'offset': self.offset
+                            },
+                'diskname': self.read_diskname(),
+                'disktype': self.disktype,
+                # Types simples uniquement, le cache doit pouvoir etre relu
+                # que ftdos soit importe ou lance comme script
+                'dirents': [entry.__getstate__() for entry in self.dirents.values()],
+                'bitmap': self.read_bitmap(),
+                'index': dict([(key, tuple(loc)) for key, loc in self.sector_index().items()])
+                }
+
+    def _restore(self, state):
+        params = state['params']
+
+        self.signature = 'MFM_DISK'
+        self.dos = params['dos']
+        self.sides = params['sides']
+        self.tracks = params['tracks']
+        self.sectors = params['sectors']
+        self.sectorsize = params['sectorsize']
+        self.geometry = params['geometry']
+        self.offset = params['offset']
+
+        self.diskname = state['diskname']
+        self.disktype = state['disktype']
+
+        dirents = []
+        for values in state['dirents']:
+            entry = DirEntry.__new__(DirEntry)
+            entry.__setstate__(values)
+            dirents.append(entry)
+
+        self.dirents = FTDOS_Catalog(dirents)
+        self._index = dict([(key, SectorLoc._make(loc)) for key, loc in state['index'].items()])
+        self._cached = dict(state, dirents=self.dirents)
+        self._dir_complete = True
+
+    def read_diskname(self):
+        if self._cached is not None:
+            self.diskname = self._cached['diskname']
+            return self.diskname
+
+        P = 20
+        S = 1
+        cat = self.read_sector(P, S)
+
+        self.diskname = cat[-8:]
+        # print(dump(cat))
+
+        return self.diskname
+
+    def read_bitmap(self):
+        if self._cached is not None:
+            return self._cached['bitmap']
+
+        return self.read_sector(20, 1)
+
+    def read_dir(self):
+        if self._cached is not None:
+            self.dirents = self._cached['dirents'].copy()
+            self._dir_complete = True
+            return self.dirents
+
+        if not self._dir_complete:
+            with self._timer('catalog'):
+                for entry in self.iter_dir():
+                    pass
+
+        # self.dirents['BOOTSECT.BIN'] = {'side': 0, 'track': 0, 'sector': 1, 'lock': 'L', 'type': 'D', 'size': 1, 'content_type': 'asm'}
+        return self.dirents
+
+    def iter_dir(self):
+        # Entrees du catalogue au fur et a mesure du decodage des secteurs.
+        # self.dirents est complete au fil du parcours, il n'est marque
+        # complet (et mis en cache) qu'a la fin du chainage.
+        if self._dir_complete or self._cached is not None:
+            for entry in list(self.read_dir().values()):
+                yield entry
+            return
+
+        self.dirents = FTDOS_Catalog()
+        for entry in self.FTDOS_iter_cat():
+            self.dirents.add(entry)
+            yield entry
+
+        self._dir_complete = True
+
+        if self.cache is not None:
+            self.cache.put(self.source, self._cache_state())
+
+    def find_entry(self, name):
+        # Recherche par nom complet ('NOM     .EXT') ou reduit ('NOM.EXT'), le
+        # parcours du catalogue s'arrete des que le fichier est trouve
+        for entry in self.iter_dir():
+            if entry.name == name or entry.stripped_name == name:
+                return entry
+
+        return None
+
+    def select(self, selector):
+        # Entrees retenues par selector (FTDOS_Selector). Pour une liste de
+        # noms sans caractere generique, le parcours du catalogue s'arrete
+        # des que tous les fichiers ont ete trouves.
+        names = selector.literal_names()
+
+        if names is None:
+            return selector.select(self.read_dir())
+
+        entries = []
+        names = set(names)
+        for entry in self.iter_dir():
+            if entry.stripped_name.upper() in names:
+                entries.append(entry)
+                names.discard(entry.stripped_name.upper())
+
+                if not names:
+                    break
+
+        return sorted(entries, key=lambda entry: entry.name)
+
+    def file_info(self, filename):
+        if filename == 'FTDOS3-2.SYS' or filename == 'TDOS2-26.SYS':
+            start = 0xc000
+            size = (3 * self.sectors - 2 + 11) * self.sectorsize
+            return {'start': start, 'size': size, 'end': start+size, 'type': 0x40, 'exec': 0xd4f8}
+
+        elif filename == 'BOOTSECT.BIN':
+            return {'start': 0x400, 'size': 256, 'end': 0x500, 'type': 0x40, 'exec': 0x00}
+
+        else:
+            return self.FTDOS_file_info(filename)
+
+    def iter_file(self, filename, size=None):
+        # Contenu du fichier, secteur par secteur
+        if size is None:
+            size = self.file_info(filename)['size']
+
+        if filename == 'FTDOS3-2.SYS' or filename == 'TDOS2-26.SYS':
+            # 0 => ROM 1.1 ou disquette !MASTER
+            # 4 => ROM 1.0
+            return iter([self.FTDOS_getsys()])
+
+        elif filename == 'BOOTSECT.BIN':
+            return iter([self.read_sector(0, 1)])
+
+        else:
+            return self.FTDOS_iter_file(filename, size)
+
+    def extents(self, filename):
+        # Chaine des FCB resolue une seule fois par fichier
+        if filename not in self._extents:
+            if filename == 'FTDOS3-2.SYS' or filename == 'TDOS2-26.SYS':
+                extents = self._make_extents(self.FTDOS_sys_sectors(self.FTDOS_sys_track()))
+
+            elif filename == 'BOOTSECT.BIN':
+                extents = self._make_extents([(0, 1)])
+
+            else:
+                extents = self.FTDOS_extents(filename)
+
+            self._extents[filename] = (extents, [extent.offset for extent in extents])
+
+        return self._extents[filename][0]
+
+    def _make_extents(self, sectors, side=0):
+        index = self.sector_index()
+        extents = []
+        offset = 0
+
+        for P, S in sectors:
+            loc = index.get((side, P, S))
+            length = 1 << (loc.size + 7) if loc is not None else self.sectorsize
+
+            extents.append(FileExtent(offset, side, P, S, length))
+            offset += length
+
+        return extents
+
+    def file_size(self, filename):
+        if filename not in self._sizes:
+            self._sizes[filename] = self.file_info(filename)['size']
+
+        return self._sizes[filename]
+
+    def read_at(self, filename, offset, length=None):
+        # Lecture de length octets a partir de offset, seuls les secteurs
+        # concernes sont lus
+        if offset < 0:
+            raise ValueError('negative offset %d' % offset)
+
+        size = self.file_size(filename)
+        if length is None:
+            length = size - offset
+
+        end = min(offset + length, size)
+        if offset >= end:
+            return b''
+
+        extents = self.extents(filename)
+        i = bisect.bisect_right(self._extents[filename][1], offset) - 1
+
+        chunks = []
+        pos = offset
+        while pos < end and i < len(extents):
+            extent = extents[i]
+            data = self.read_sector(extent.track, extent.sector, extent.side)
+
+            chunks.append(data[pos - extent.offset:min(end, extent.offset + extent.length) - extent.offset])
+            pos = extent.offset + extent.length
+            i += 1
+
+        return b''.join(chunks)
+
+    def open_file(self, filename):
+        info = self.file_info(filename)
+        self._sizes[filename] = info['size']
+
+        return FTDOS_File(self, filename, info)
+
+    def readinto(self, filename, buf):
+        view = memoryview(buf)
+        n = 0
+
+        for data in self.iter_file(filename):
+            length = min(len(data), len(view) - n)
+            view[n:n + length] = data[0:length]
+            n += length
+
+            if n == len(view):
+                break
+
+        return n
+
+    def read_file(self, filename):
+        info = self.file_info(filename)
+        info['file'] = b''.join(self.iter_file(filename, info['size']))
+
+        return info
+
+    def _cat(self, sort=True):
+        # sort=False: affichage dans l'ordre du catalogue, au fil de la
+        # lecture
+        if sort:
+            entries = sorted(self.read_dir().values(), key=lambda entry: entry.name)
+        else:
+            entries = self.iter_dir()
+
+        for entry in entries:
+            print('S:%01d P:%02d S:%02d        %c %s %3d   %c (%s)' % (
+                    entry.side,
+                    entry.track,
+                    entry.sector,
+                    entry.lock,
+                    entry.name,
+                    entry.size,
+                    entry.type,
+                    entry.content_type)
+                    )
+
+    def display_bitmap(self):
+        return self.FTDOS_display_bitmap()
+
+    def system_entries(self):
+        # Pseudo-entrees du catalogue pour le secteur de boot et le systeme.
+        # Un fichier du meme nom deja present dans le catalogue (FTDOS3-2.SYS
+        # sur une disquette systeme) n'est pas repete.
+        start_track = self.FTDOS_sys_track()
+        names = set([entry.stripped_name for entry in self.read_dir().values()])
+
+        return [entry for entry in (DirEntry('BOOTSECT.BIN', 'BOOTSECT.BIN', 0, 0, 1, 'L', 'D', 1, 'asm'),
+                                    DirEntry('FTDOS3-2.SYS', 'FTDOS3-2.SYS', 0, start_track, 3, 'L', 'D', len(self.FTDOS_sys_sectors(start_track)), 'asm'))
+                if entry.stripped_name not in names]
+
+    def FTDOS_chain(self, P, S, link):
+        # Parcours d'une chaine de secteurs: catalogue (lien en 2-3) ou FCB
+        # (lien en 0-1). FF xx ou xx 00 termine la chaine.
+        seen = set()
+
+        while P != 0xff and S != 0x00:
+            if P >= self.tracks or S > self.sectors:
+                raise FTDOS_SectorError('out_of_geometry', P, S)
+
+            if (P, S) in seen:
+                raise FTDOS_SectorError('loop', P, S)
+
+            seen.add((P, S))
+            data = self.read_sector(P, S)
+            yield P, S, data
+
+            P = ord(data[link])
+            S = ord(data[link + 1])
+
+    def FTDOS_cat(self):
+        return FTDOS_Catalog(self.FTDOS_iter_cat())
+
+    def FTDOS_iter_cat(self):
+        # Lecture premier secteur du catalogue S:0 P:20 S:2
+        # Chainage vers le catalogue suivant: FF 00 si dernier secteur
+        # ou 00 00 si premier secteur et catalogue vide
+        for P, S, cat in self.FTDOS_chain(20, 2, 2):
+            for entry in self.FTDOS_cat_entries(cat):
+                yield entry
+
+    def FTDOS_cat_entries(self, cat):
+        # Entrees d'un secteur du catalogue.
+        # Les octets 0-1 doivent etre egaux a la piste et au secteur lu si on
+        # n'est pas sur le premier secteur du catalogue (P:20 S:2)
+        entries = []
+
+        for i in range(0, 14):
+            entry_offset = 4 + i * 18
+            entry = self.FTDOS_DirEntry(cat[entry_offset:entry_offset + 18])
+            if entry is not None:
+                entries.append(entry)
+
+        return entries
+
+    def FTDOS_DirEntry(self, entry):
+        track = ord(entry[0])
+        sector = ord(entry[1])
+        lock = entry[2]
+
+        name = entry[3:15]
+        stripped_name = name[0:8].rstrip()
+        stripped_ext = name[9:12].rstrip()
+        if stripped_ext > '':
+            stripped_name = stripped_name + '.' + stripped_ext
+
+        type = entry[15]
+        size = struct.unpack('<H', entry[16:18])[0]
+        side = 0
+
+        if track != 255:
+            # print 'P:%02d S:%02d %c %s %c %d' % (track, sector, lock, name, type, len)
+            # print '%c  %s  %c       %d SECTORS' % (lock, name, type, len)
+            if name[-3:] == 'BAS':
+                content_type = 'basic'
+            elif name[-3:] in ['CMD', 'SYS', 'BIN']:
+                # content_type = '6502'
+                content_type = 'asm'
+            elif name[-3:] == 'ARY':
+                content_type = 'array'
+            elif name[-3:] == 'SCR':
+                if size == 6:
+                    content_type = 'lscreen'
+                else:
+                    content_type = 'hscreen'
+            elif name[-3:] == 'DAT':
+                content_type = 'data'
+            elif name[-3:] == 'TXT':
+                content_type = 'text'
+            else:
+                content_type = '???'
+
+            return DirEntry(name, stripped_name, side, track, sector, lock, type, size, content_type)
+
+        return None
+
+    def FTDOS_file_info(self, filename):
+        # Lecture du premier FCB: adresse de chargement et taille
+        fcb = self.read_sector(self.dirents[filename]['track'], self.dirents[filename]['sector'])
+
+        start = struct.unpack('<H', fcb[2:4])[0]
+        size = struct.unpack('<H', fcb[4:6])[0]
+
+        # Correction bug FTDOS-3.2, la taille indiquee pour les tableaux
+        # et les ecrans
+        # fait 1 octet de moins que la realite!!!
+        if filename[-3:] == 'ARY':
+            size += size % 2
+        if filename[-3:] == 'SCR':
+            size += 1
+
+        # Calcule un type Sedoric
+        # Execution := 0x000
+        # Type      := Data
+        exec_addr = 0x00
+        type = 0x40
+
+        if filename[-3:] == 'BAS':
+            type = 0x80
+        elif filename[-3:] in ['CMD', 'SYS', 'BIN']:
+            exec_addr = start
+
+        if self.verbose:
+            print('Fichier              : ', filename)
+            print('Type                 :  %02X' % (type) )
+            print('Adresse de chargement: ', hex(start))
+
+            if exec_addr == 0x40:
+                print('Adresse Execution    : ', hex(exec_addr))
+
+            print('Taille               : ', size)
+            print('')
+
+        return {'start': start, 'size': size, 'end': start+size, 'exec': exec_addr, 'type': type}
+
+    def FTDOS_fcb_chain(self, filename):
+        # Parcours de la chaine des FCB, renvoie (P, S, fcb) pour chaque FCB
+        entry = self.dirents[filename]
+
+        # Chainage vers le FCB suivant en 0-1
+        for P_FCB, S_FCB, fcb in self.FTDOS_chain(entry.track, entry.sector, 0):
+            if self.stats is not None:
+                self.stats.count('fcbs_walked')
+
+            yield P_FCB, S_FCB, fcb
+
+    def FTDOS_iter_sectors(self, filename):
+        # Renvoie les (P, S) des secteurs de donnees, dans l'ordre des FCB
+        for P_FCB, S_FCB, fcb in self.FTDOS_fcb_chain(filename):
+            n = 6
+            P = 0
+            S = 0
+            while n <= 254 and P != 0xff and S != 0xff:
+                P = ord(fcb[n])
+                S = ord(fcb[n + 1])
+                n += 2
+
+                if P != 0xff and S != 0xff:
+                    yield P, S
+
+    def FTDOS_extents(self, filename):
+        return self._make_extents(self.FTDOS_iter_sectors(filename))
+
+    def FTDOS_iter_file(self, filename, size):
+        for extent in self.extents(filename):
+            if size <= 0:
+                break
+
+            data = self.read_sector(extent.track, extent.sector, extent.side)[0:size]
+            size -= len(data)
+            yield data
+
+    def FTDOS_read_file(self, filename):
+        info = self.FTDOS_file_info(filename)
+        info['file'] = b''.join(self.FTDOS_iter_file(filename, info['size']))
+
+        return info
+
+    def FTDOS_sys_sectors(self, start_track=0):
+        # ROM v1.1  0 -> 2 + 11 secteurs de la 3
+        # ROM v1.0  4 -> 6 + 11 secteurs de la 7
+        sectors = []
+
+        # On lit 3 pistes
+        for P in range(start_track, start_track + 3):
+            start_sector = 1
+            if P == start_track:
+                # Si c'est la premiere piste, on commence au secteur 3
+                start_sector = 3
+
+            sectors.extend([(P, S) for S in range(start_sector, self.sectors + 1)])
+
+        # Lecture des 11 secteurs de la piste suivante
+        sectors.extend([(start_track + 3, S) for S in range(1, 11 + 1)])
+
+        return sectors
+
+    def FTDOS_iter_sys(self, start_track=0):
+        for P, S in self.FTDOS_sys_sectors(start_track):
+            yield self.read_sector(P, S)
+
+    def FTDOS_sys_track(self):
+        # Premiere piste du systeme: 4 pour la ROM 1.0, 0 pour la ROM 1.1.
+        # Les deux emplacements sont notes une seule fois a partir de l'index:
+        # secteurs presents, CRC corrects et pistes marquees occupees dans le
+        # bitmap. En cas d'egalite, l'emplacement qui ne contient le premier
+        # FCB d'aucun fichier du catalogue l'emporte (catalogue seul, sans
+        # parcours des FCB), puis celui de la ROM 1.0.
+        if self._sys_track is None:
+            index = self.sector_index()
+            bitmap = self.bitmap()
+
+            scores = {}
+            for start_track in (4, 0):
+                sectors = [(0, P, S) for P, S in self.FTDOS_sys_sectors(start_track)]
+                score = 0
+
+                if all([loc in index for loc in sectors]):
+                    score += 1
+
+                    if all([index[loc][4] for loc in sectors]):
+                        score += 1
+
+                    if not any([bitmap.is_free(*loc) for loc in sectors if loc[2] <= FTDOS_Bitmap.SECTORS]):
+                        score += 2
+
+                scores[start_track] = [score, sectors]
+
+            if scores[4][0] == scores[0][0]:
+                try:
+                    fcbs = set([(0, entry.track, entry.sector) for entry in self.read_dir().values()])
+                except FTDOS_SectorError:
+                    # Catalogue illisible: le critere est ignore
+                    fcbs = set()
+
+                for start_track in (4, 0):
+                    if not any([loc in fcbs for loc in scores[start_track][1]]):
+                        scores[start_track][0] += 1
+
+            self._sys_track = 0 if scores[0][0] > scores[4][0] else 4
+
+        return self._sys_track
+
+    def FTDOS_getsys(self, start_track=None):
+        if start_track is None:
+            start_track = self.FTDOS_sys_track()
+
+        if start_track not in self._sys_cache:
+            if self.stats is not None:
+                self.stats.count('system_reads')
+
+            # Secteur absent: FTDOS_SectorError('missing') par read_sector()
+            self._sys_cache[start_track] = b''.join(self.FTDOS_iter_sys(start_track))
+
+        return self._sys_cache[start_track]
+
+    def FTDOS_display_bitmap(self):
+        raw = self.read_bitmap()
+        print(dump(raw))
+
+        bitmap = self.bitmap()
+        free = bitmap.tolist()
+
+        out = []
+        for P in range(0, self.tracks):
+            line = ['Track %02d: ' % P]
+
+            for side in range(0, self.sides):
+                T = side * self.tracks + P
+                if side > 0:
+                    line.append(' : ')
+
+                line.append('%02X %02X %02X ' % (ord(raw[T * 3 + 2]), ord(raw[T * 3 + 1]), ord(raw[T * 3])))
+                line.append(''.join([f and '. ' or '* ' for f in free[side][P]]))
+
+            out.append(''.join(line))
+
+        return out
+
+    def bitmap(self):
+        return FTDOS_Bitmap(self.read_bitmap(), self.sides, self.tracks)
+
+    def dump_sector(self, stream, track, sector, side=0):
+        dump_to(stream, self.read_sector(track, sector, side))
+
+    def dump_track(self, stream, track, side=0):
+        # Piste brute (octets MFM_DISK), adresses relatives au debut de
+        # l'image
+        ptr = self.offset + (side * self.tracks + track) * self.tracksize
+        image = self.open_image()
+
+        dump_to(stream, image[ptr:ptr + self.tracksize], ptr)
+
+    def dump_image(self, stream):
+        dump_to(stream, self.open_image())
+
+    def owners(self):
+        # Secteurs occupes par chaque fichier (FCB et donnees):
+        #   (face, piste, secteur) -> [nom, ...]
+        self.read_dir()
+
+        owners = {}
+        for filename in self.dirents:
+            sectors = [(P, S) for P, S, fcb in self.FTDOS_fcb_chain(filename)]
+            sectors.extend(self.FTDOS_iter_sectors(filename))
+
+            for P, S in sectors:
+                owners.setdefault((0, P, S), []).append(filename)
+
+        return owners
+
+    def usage(self):
+        # Rapport d'occupation du disque
+        bitmap = self.bitmap()
+        owners = self.owners()
+
+        free = bitmap.free_sectors()
+
+        files = {}
+        for filename in self.dirents:
+            sectors = [(0, P, S) for P, S in self.FTDOS_iter_sectors(filename)]
+            files[filename] = {'sectors': len(sectors), 'extents': len(FTDOS_Bitmap.extents(sectors, self.sectors))}
+
+        report = bitmap.stats()
+        report['files'] = files
+        report['shared'] = sorted([loc for loc, names in owners.items() if len(names) > 1])
+        report['free_but_used'] = sorted([loc for loc in owners if loc in free])
+
+        return report
+
+    def verify(self):
+        # Controle de l'image sans extraction:
+        #   - CRC de l'ID et des donnees de chaque secteur, calcules une seule
+        #     fois par piste lors de l'indexation
+        #   - secteurs absents des pistes formatees
+        #   - chainage du catalogue et des FCB: boucles, pointeurs hors de
+        #     la geometrie ou vers un secteur absent
+        #   - secteurs de donnees des fichiers absents ou avec un CRC faux
+        index = self.sector_index()
+
+        report = {'sectors': len(index),
+                  'unformatted_tracks': [],
+                  'missing_sectors': [],
+                  'bad_id_crc': [],
+                  'bad_data_crc': [],
+                  'catalog': {'sectors': 0, 'entries': 0, 'error': None},
+                  'files': {}
+                  }
+
+        formatted = set([(side, P) for side, P, S in index])
+
+        for side in range(0, self.sides):
+            for P in range(0, self.tracks):
+                if (side, P) not in formatted:
+                    report['unformatted_tracks'].append([side, P])
+                else:
+                    report['missing_sectors'].extend([[side, P, S] for S in range(1, self.sectors + 1) if (side, P, S) not in index])
+
+        for key, loc in sorted(index.items()):
+            if not loc.id_crc:
+                report['bad_id_crc'].append(list(key))
+            if not loc.data_crc:
+                report['bad_data_crc'].append(list(key))
+
+        bad_crc = set([tuple(key) for key in report['bad_id_crc'] + report['bad_data_crc']])
+
+        catalog = report['catalog']
+        self.dirents = FTDOS_Catalog()
+        try:
+            for P, S, cat in self.FTDOS_chain(20, 2, 2):
+                catalog['sectors'] += 1
+
+                if (0, P, S) in bad_crc:
+                    catalog.setdefault('bad_crc', []).append([0, P, S])
+
+                for entry in self.FTDOS_cat_entries(cat):
+                    self.dirents.add(entry)
+
+        except FTDOS_SectorError as e:
+            catalog['error'] = e.as_dict()
+
+        catalog['entries'] = len(self.dirents)
+
+        for filename in sorted(self.dirents.keys()):
+            damage = {}
+
+            try:
+                for P, S in self.FTDOS_iter_sectors(filename):
+                    if P >= self.tracks or S < 1 or S > self.sectors:
+                        damage.setdefault('out_of_geometry', []).append([0, P, S])
+                    elif (0, P, S) not in index:
+                        damage.setdefault('missing', []).append([0, P, S])
+                    elif (0, P, S) in bad_crc:
+                        damage.setdefault('bad_crc', []).append([0, P, S])
+
+            except FTDOS_SectorError as e:
+                damage['error'] = e.as_dict()
+
+            if damage:
+                report['files'][_text(self.dirents[filename].stripped_name)] = damage
+
+        damaged = report['missing_sectors'] or bad_crc or catalog['error'] or 'bad_crc' in catalog or report['files']
+        report['status'] = 'damaged' if damaged else 'ok'
+
+        return report
+
+    def sector_hashes(self):
+        # Empreinte des donnees de chaque secteur present sur les deux faces,
+        # a partir de l'index des pistes. Calculee une seule fois par image
+        # et conservee dans le cache persistant s'il y en a un.
+        if self._hashes is None and self.cache is not None:
+            self._hashes = self.cache.get_hashes(self.source)
+
+        if self._hashes is None:
+            index = self.sector_index()
+            image = self.open_image()
+
+            with self._timer('hash'):
+                self._hashes = dict([(key, hashlib.sha1(image[loc.data_ptr:loc.data_ptr + (1 << (loc.size + 7))]).hexdigest()) for key, loc in index.items()])
+
+            if self.stats is not None:
+                self.stats.count('sectors_hashed', len(self._hashes))
+
+            if self.cache is not None:
+                self.cache.put_hashes(self.source, self._hashes)
+
+        return self._hashes
+
+    def sector_signature(self):
+        # Resume de l'image pour diff_signatures(): empreintes des secteurs,
+        # zones du disque et secteurs (FCB et donnees) de chaque fichier.
+        #   regions: (face, piste, secteur) -> 'boot', 'system', 'bitmap' ou 'catalog'
+        #   files:   nom -> {'fcb': [...], 'data': [...], 'size': taille}
+        regions = {}
+        try:
+            for P, S in self.FTDOS_sys_sectors(self.FTDOS_sys_track()):
+                regions[(0, P, S)] = 'system'
+        except FTDOS_SectorError:
+            # Catalogue illisible, l'emplacement du systeme est inconnu
+            pass
+
+        regions[(0, 0, 1)] = 'boot'
+        regions[(0, 20, 1)] = 'bitmap'
+
+        signature = {'hashes': self.sector_hashes(), 'regions': regions, 'files': {}, 'error': None}
+
+        # Catalogue lu secteur par secteur pour en garder les emplacements
+        self.dirents = FTDOS_Catalog()
+        try:
+            for P, S, cat in self.FTDOS_chain(20, 2, 2):
+                regions[(0, P, S)] = 'catalog'
+
+                for entry in self.FTDOS_cat_entries(cat):
+                    self.dirents.add(entry)
+
+        except FTDOS_SectorError as e:
+            signature['error'] = e.as_dict()
+
+        for filename, entry in self.dirents.items():
+            record = {'fcb': [], 'data': [], 'size': None}
+
+            try:
+                record['fcb'] = [(0, P, S) for P, S, fcb in self.FTDOS_fcb_chain(filename)]
+                record['data'] = [(0, P, S) for P, S in self.FTDOS_iter_sectors(filename)]
+                record['size'] = self.file_size(filename)
+
+            except FTDOS_SectorError as e:
+                record['error'] = '%s: %s' % (e.__class__.__name__, e)
+
+            signature['files'][_text(entry.stripped_name)] = record
+
+        return signature
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_Bitmap():
+    # Bitmap d'occupation FT-DOS (piste 20, secteur 1)
+    #
+    # 3 octets par piste, pour les pistes de la face 0 puis celles de la face 1:
+    #   octet 2: b7 piste reservee, b0 secteur 1
+    #   octet 1: b7..b0 secteurs 2 a 9
+    #   octet 0: b7..b0 secteurs 10 a 17
+    # Un bit a 1 indique un secteur libre.
+    SECTORS = 17
+
+    # Bits de chaque octet, du poids fort au poids faible
+    BITS = [tuple([(b >> j) & 1 == 1 for j in range(7, -1, -1)]) for b in range(256)]
+
+    def __init__(self, raw, sides, tracks):
+        self.sides = sides
+        self.tracks = tracks
+        self.free = self.decode(raw, sides, tracks)
+
+    @classmethod
+    def decode(cls, raw, sides, tracks):
+        count = sides * tracks
+        numpy = load_numpy()
+
+        if numpy is not None:
+            data = numpy.frombuffer(raw[0:count * 3], dtype=numpy.uint8).reshape(count, 3)[:, ::-1]
+            bits = numpy.unpackbits(data, axis=1)[:, 7:]
+            bits[data[:, 0] >= 0x80] = 0
+
+            return bits.astype(bool).reshape(sides, tracks, cls.SECTORS)
+
+        BITS = cls.BITS
+        free = []
+        for side in range(0, sides):
+            rows = []
+            for P in range(0, tracks):
+                T = (side * tracks + P) * 3
+                b2 = ord(raw[T + 2])
+
+                if b2 >= 0x80:
+                    rows.append([False] * cls.SECTORS)
+                else:
+                    rows.append(list(BITS[b2][7:] + BITS[ord(raw[T + 1])] + BITS[ord(raw[T])]))
+
+            free.append(rows)
+
+        return free
+
+    def tolist(self):
+        numpy = load_numpy()
+
+        if numpy is not None and isinstance(self.free, numpy.ndarray):
+            return self.free.tolist()
+
+        return self.free
+
+    def is_free(self, side, track, sector):
+        return bool(self.free[side][track][sector - 1])
+
+    def free_sectors(self):
+        free = set()
+        for side, rows in enumerate(self.tolist()):
+            for P, row in enumerate(rows):
+                for S, f in enumerate(row):
+                    if f:
+                        free.add((side, P, S + 1))
+
+        return free
+
+    @staticmethod
+    def extents(sectors, sectors_per_track=17):
+        # Regroupe une liste de (face, piste, secteur) en suites contigues
+        extents = []
+        previous = None
+
+        for side, P, S in sectors:
+            linear = (side * 256 + P) * sectors_per_track + S - 1
+            if previous is not None and linear == previous + 1:
+                extents[-1][1] += 1
+            else:
+                extents.append([(side, P, S), 1])
+            previous = linear
+
+        return extents
+
+    def stats(self):
+        numpy = load_numpy()
+
+        if numpy is not None and isinstance(self.free, numpy.ndarray):
+            flat = self.free.reshape(-1)
+            free = int(flat.sum())
+
+            edges = numpy.diff(numpy.concatenate(([0], flat.astype(numpy.int8), [0])))
+            starts = numpy.flatnonzero(edges == 1)
+            ends = numpy.flatnonzero(edges == -1)
+            runs = (ends - starts).tolist()
+        else:
+            runs = []
+            free = 0
+            length = 0
+            for rows in self.free:
+                for row in rows:
+                    for f in row:
+                        if f:
+                            length += 1
+                        elif length:
+                            runs.append(length)
+                            length = 0
+                    free += sum(row)
+            if length:
+                runs.append(length)
+
+        total = self.sides * self.tracks * self.SECTORS
+        largest = max(runs) if runs else 0
+
+        return {'sectors': total,
+                'free': free,
+                'used': total - free,
+                'free_extents': len(runs),
+                'largest_free_extent': largest,
+                # 0: espace libre d'un seul tenant, tend vers 1 si morcele
+                'fragmentation': 1.0 - float(largest) / free if free else 0.0
+                }
+
+
+# ------------------------------------------------------------------------------
+def sha1_file(filename):
+    # Empreinte SHA-1 du contenu d'un fichier, lu par blocs de 1 Mo
+    sha = hashlib.sha1()
+
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _pickle():
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+
+    return pickle
+
+
+class FTDOS_Cache():
+    # Cache persistant des images analysees: en-tete, catalogue, bitmap et
+    # index des secteurs (<sha1>.cache), empreintes des secteurs
+    # (<sha1>.hashes).
+    #
+    # Les entrees sont nommees d'apres le SHA-1 du contenu de l'image, un
+    # fichier par chemin memorise la taille et la date de modification pour
+    # eviter de recalculer l'empreinte tant que l'image n'a pas change.
+    FORMAT = 2
+    SUFFIXES = ('.cache', '.hashes')
+
+    # Taille estimee de chaque repertoire de cache pour ce processus: elle
+    # est augmentee a chaque ecriture, le repertoire n'est parcouru (evict)
+    # que lorsqu'elle depasse max_size
+    _sizes = {}
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+
+        for d in (self.directory, os.path.join(self.directory, 'paths')):
+            if not os.path.isdir(d):
+                try:
+                    os.makedirs(d)
+                except OSError:
+                    # Cree entre-temps par un autre processus
+                    pass
+
+    def _path_file(self, diskimg):
+        return os.path.join(self.directory, 'paths', hashlib.sha1(os.path.abspath(diskimg).encode('utf-8')).hexdigest())
+
+    def _entry_file(self, key, suffix='.cache'):
+        return os.path.join(self.directory, key + suffix)
+
+    def _load(self, filename):
+        pickle = _pickle()
+
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, filename, data):
+        import tempfile
+        pickle = _pickle()
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.chmod(tmp, FILE_MODE)
+        os.rename(tmp, filename)
+
+        if self.directory in self._sizes:
+            self._sizes[self.directory] += size
+
+    def key(self, diskimg):
+        st = os.stat(diskimg)
+        stamp = (st.st_size, st.st_mtime)
+
+        path_file = self._path_file(diskimg)
+        try:
+            record = self._load(path_file)
+            if record['stamp'] == stamp:
+                # Date d'acces pour l'eviction LRU
+                os.utime(path_file, None)
+                return record['key']
+        except Exception:
+            pass
+
+        key = sha1_file(diskimg)
+        self._save(path_file, {'stamp': stamp, 'key': key})
+
+        return key
+
+    def get(self, diskimg):
+        try:
+            entry_file = self._entry_file(self.key(diskimg))
+            entry = self._load(entry_file)
+        except Exception:
+            return None
+
+        if entry.get('format') != self.FORMAT:
+            return None
+
+        # Date d'acces pour l'eviction LRU
+        try:
+            os.utime(entry_file, None)
+        except OSError:
+            pass
+
+        state = entry['state']
+        state['params'] = dict(state['params'], source=os.path.abspath(diskimg))
+
+        return state
+
+    def put(self, diskimg, state):
+        try:
+            self._save(self._entry_file(self.key(diskimg)), {'format': self.FORMAT, 'state': state})
+        except (IOError, OSError) as e:
+            eprint('Cache: %s' % e)
+            return
+
+        self._evict_if_full()
+
+    def get_hashes(self, diskimg):
+        try:
+            entry = self._load(self._entry_file(self.key(diskimg), '.hashes'))
+        except Exception:
+            return None
+
+        if entry.get('format') != self.FORMAT:
+            return None
+
+        return entry['hashes']
+
+    def put_hashes(self, diskimg, hashes):
+        try:
+            self._save(self._entry_file(self.key(diskimg), '.hashes'), {'format': self.FORMAT, 'hashes': hashes})
+        except (IOError, OSError) as e:
+            eprint('Cache: %s' % e)
+            return
+
+        self._evict_if_full()
+
+    def invalidate(self, diskimg):
+        path_file = self._path_file(diskimg)
+
+        try:
+            key = self._load(path_file)['key']
+        except Exception:
+            key = None
+
+        if key is not None:
+            for suffix in self.SUFFIXES:
+                try:
+                    os.remove(self._entry_file(key, suffix))
+                except OSError:
+                    pass
+
+        try:
+            os.remove(path_file)
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIXES):
+                os.remove(os.path.join(self.directory, name))
+
+        paths = os.path.join(self.directory, 'paths')
+        for name in os.listdir(paths):
+            os.remove(os.path.join(paths, name))
+
+        self._sizes[self.directory] = 0
+
+    def _evict_if_full(self):
+        # Premiere ecriture du processus (taille inconnue) ou estimation
+        # au-dela de la limite
+        if self._sizes.get(self.directory, self.max_size + 1) > self.max_size:
+            self.evict()
+
+    def evict(self):
+        # Les fiches des chemins (paths/) comptent dans la taille du cache et
+        # sont supprimees comme les entrees, les plus anciennes d'abord: une
+        # fiche supprimee oblige seulement a recalculer l'empreinte de l'image
+        paths = os.path.join(self.directory, 'paths')
+
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(self.SUFFIXES)]
+        files.extend([os.path.join(paths, name) for name in os.listdir(paths)])
+
+        entries = []
+        total = 0
+
+        for filename in files:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, filename))
+            total += st.st_size
+
+        # Suppression des entrees les plus anciennes. Au-dela de max_size le
+        # cache est ramene aux trois quarts de la limite, pour que les
+        # ecritures suivantes ne provoquent pas aussitot un nouveau parcours.
+        if total <= self.max_size:
+            entries = []
+
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_size * 3 // 4:
+                break
+
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+            total -= size
+
+        self._sizes[self.directory] = total
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_Store():
+    # Stockage des fichiers extraits par contenu: chaque contenu distinct est
+    # ecrit une seule fois sous objects/xx/<sha1>
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, 'objects', key[0:2], key)
+
+    def _makedirs(self, directory):
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Cree entre-temps par un autre processus
+                pass
+
+    def add(self, chunks):
+        # Le contenu est ecrit dans un fichier temporaire au fil de la
+        # lecture, pendant le calcul de l'empreinte. Le fichier temporaire est
+        # renomme si le contenu est nouveau, supprime sinon.
+        import tempfile
+
+        objects = os.path.join(self.directory, 'objects')
+        self._makedirs(objects)
+
+        sha = hashlib.sha1()
+        size = 0
+
+        fd, tmp = tempfile.mkstemp(dir=objects)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            key = sha.hexdigest()
+            filename = self.path(key)
+
+            if os.path.exists(filename):
+                os.remove(tmp)
+                return key, size, False
+
+            self._makedirs(os.path.dirname(filename))
+            os.chmod(tmp, FILE_MODE)
+            os.rename(tmp, filename)
+
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return key, size, True
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_Stats():
+    # Compteurs et durees cumulees des phases (secondes).
+    #
+    # Les durees des phases imbriquees se recouvrent: l'indexation est
+    # comprise dans validate, la lecture des fichiers dans extract.
+    COUNTERS = ('tracks_scanned', 'sectors_decoded', 'tracks_read', 'sectors_read', 'bytes_read',
+                'track_cache_hits', 'track_cache_misses', 'catalog_cache_hits', 'catalog_cache_misses',
+                'fcbs_walked', 'system_reads', 'sectors_hashed', 'files_written', 'bytes_written')
+
+    def __init__(self):
+        self.counters = dict([(name, 0) for name in self.COUNTERS])
+        self.timers = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    def timer(self, phase):
+        return FTDOS_Timer(self, phase)
+
+    def merge(self, report):
+        # Cumul du rapport d'une autre mesure (extraction par lot)
+        for name, n in report['counters'].items():
+            self.count(name, n)
+
+        for phase, seconds in report['timers'].items():
+            self.add_time(phase, seconds)
+
+    def report(self):
+        return {'counters': dict(self.counters), 'timers': dict(self.timers)}
+
+
+class FTDOS_Timer():
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.phase, timeit.default_timer() - self.start)
+        return False
+
+
+class _NoTimer():
+    # Mesure desactivee
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_TIMER = _NoTimer()
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_File(io.RawIOBase):
+    # Fichier en lecture seule avec acces direct (ftdos.read_at)
+    def __init__(self, fs, name, info):
+        io.RawIOBase.__init__(self)
+        self.fs = fs
+        self.name = name
+        self.info = info
+        self.size = info['size']
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('invalid whence (%r)' % whence)
+
+        if pos < 0:
+            raise ValueError('negative seek position %d' % pos)
+
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        data = self.fs.read_at(self.name, self._pos, len(b))
+
+        n = len(data)
+        b[0:n] = data
+        self._pos += n
+
+        return n
+
+
+# ------------------------------------------------------------------------------
+def write_header(output, filename, raw, header):
+    if header == 'orix':
+        if (raw['type'] & 0x80 == 0x80) or raw['exec'] > 0:
+            output.write(b'\x01\x00ori\x01')
+
+            # cpu_mode
+            output.write(b'\x00')
+
+            # os_type: 0-Orix, 1-Sedoric, 2-Stratsed, 3-FTDos
+            output.write(b'\x03')
+
+            # reserved
+            output.write(b'\x00' * 5)
+
+            # type_of_file: b0-Basic, b1: machine
+            if raw['type'] & 0x80 == 0x80:
+                output.write(chr(0b00000001))
+            elif raw['exec'] > 0x00:
+                output.write(chr(0b00000010))
+
+            #
+            output.write(struct.pack('<H', raw['start']))
+            output.write(struct.pack('<H', raw['end']))
+            # output.write(struct.pack('<H',raw['start'] + raw['size']))
+            output.write(struct.pack('<H', raw['exec']))
+
+    elif header == 'tape':
+        output.write('\x16\x16\x16\x16\x24')
+        output.write('\xff\xff')
+
+        if raw['type'] & 0x80 == 0x80:
+            output.write('\x00')
+        else:
+            output.write('\x80')
+
+        output.write(chr(0x00))
+
+        output.write(struct.pack('>H', raw['start'] + raw['size']))
+        output.write(struct.pack('>H', raw['start']))
+
+        output.write(chr(len(filename)))
+        output.write(filename)
+        output.write('\x00')
+
+
+# ------------------------------------------------------------------------------
+def _text(s):
+    # Noms FT-DOS -> texte pour les rapports JSON
+    if isinstance(s, bytes):
+        return s.decode('latin-1')
+    return s
+
+
+def extract_files(fs, selected, outdir='.', header=None, depth=8):
+    # Pipeline lecture / ecriture: le parcours des FCB se fait dans le thread
+    # appelant pendant qu'un thread d'ecriture cree les fichiers. La file est
+    # bornee a depth fichiers pour que la lecture n'avance pas indefiniment
+    # sur une ecriture lente.
+    #
+    # selected: liste de (nom catalogue, nom du fichier de sortie)
+    with fs._timer('extract'):
+        return _extract_files(fs, selected, outdir, header, depth)
+
+
+def _extract_files(fs, selected, outdir, header, depth):
+    import shutil
+    import threading
+
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    files = []
+    stats = fs.stats
+
+    if depth <= 0:
+        for fn, name in selected:
+            with open(os.path.join(outdir, name), 'wb') as output:
+                src = fs.open_file(fn)
+                write_header(output, fn, src.info, header)
+                shutil.copyfileobj(src, output)
+
+                if stats is not None:
+                    stats.count('files_written')
+                    stats.count('bytes_written', output.tell())
+
+            files.append(name)
+
+        return files
+
+    pending = queue.Queue(depth)
+    errors = []
+
+    # Mesures du thread d'ecriture, cumulees apres sa terminaison
+    written = [0, 0, 0.0]
+
+    def writer():
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+
+            if errors:
+                continue
+
+            filename, chunks = item
+            start = timeit.default_timer()
+            try:
+                with open(filename, 'wb') as output:
+                    for chunk in chunks:
+                        output.write(chunk)
+                        written[1] += len(chunk)
+            except Exception as e:
+                errors.append(e)
+
+            written[0] += 1
+            written[2] += timeit.default_timer() - start
+
+    thread = threading.Thread(target=writer)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        for fn, name in selected:
+            if errors:
+                break
+
+            with fs._timer('read'):
+                info = fs.file_info(fn)
+
+                hdr = io.BytesIO()
+                write_header(hdr, fn, info, header)
+
+                chunks = [hdr.getvalue()] + list(fs.iter_file(fn, info['size']))
+
+            pending.put((os.path.join(outdir, name), chunks))
+            files.append(name)
+
+    finally:
+        pending.put(None)
+        thread.join()
+
+        if stats is not None:
+            stats.count('files_written', written[0])
+            stats.count('bytes_written', written[1])
+            stats.add_time('write', written[2])
+
+    if errors:
+        raise errors[0]
+
+    return files
+
+
+def iter_image_files(diskname, selector=None, header=None, system=False, use_mmap=True, cache=None):
+    # (nom, contenu) des fichiers selectionnes d'une image, en-tete compris
+    if selector is None:
+        selector = FTDOS_Selector()
+
+    fs = ftdos(diskname, cache=cache, use_mmap=use_mmap)
+    try:
+        if fs.validate(diskname) is None:
+            raise ValueError('Invalid disk image')
+
+        fs.read_diskname()
+
+        entries = fs.select(selector)
+        if system:
+            entries.extend([entry for entry in fs.system_entries() if selector.match(entry)])
+
+        for entry in entries:
+            info = fs.file_info(entry.name)
+
+            hdr = io.BytesIO()
+            write_header(hdr, entry.name, info, header)
+
+            yield entry.stripped_name, hdr.getvalue() + b''.join(fs.iter_file(entry.name, info['size']))
+
+    finally:
+        fs.close()
+
+
+def extract_image(diskname, outdir, pattern='*', header=None, cache=None, use_mmap=True, store=None, system=False, depth=8, stats=None, selector=None):
+    # Extraction des fichiers d'une image dans outdir, ou dans le stockage
+    # par contenu store (FTDOS_Store) si il est indique.
+    # pattern: motif ou liste de motifs, ignore si selector est indique
+    files = []
+
+    if selector is None:
+        selector = FTDOS_Selector([pattern] if isinstance(pattern, str) else pattern)
+
+    fs = ftdos(diskname, cache=cache, use_mmap=use_mmap, stats=stats)
+    try:
+        if fs.validate(diskname) is None:
+            raise ValueError('Invalid disk image')
+
+        fs.read_diskname()
+        entries = fs.select(selector)
+        if system:
+            entries.extend([entry for entry in fs.system_entries() if selector.match(entry)])
+
+        if store is None and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+        extract = []
+
+        for entry in entries:
+            fn, name = entry.name, entry.stripped_name
+
+            if store is not None:
+                info = fs.file_info(fn)
+
+                hdr = io.BytesIO()
+                write_header(hdr, fn, info, header)
+
+                key, size, new = store.add(itertools.chain([hdr.getvalue()], fs.iter_file(fn, info['size'])))
+                files.append({'file': _text(name), 'hash': key, 'size': size, 'new': new})
+
+            else:
+                extract.append((fn, name))
+
+        files.extend([_text(name) for name in extract_files(fs, extract, outdir, header, depth)])
+
+    finally:
+        fs.close()
+
+    result = {'image': diskname, 'status': 'ok', 'volume': _text(fs.diskname), 'output': outdir, 'files': files}
+
+    if stats is not None:
+        result['stats'] = stats.report()
+
+    return result
+
+
+def verify_image(diskname, use_mmap=True):
+    # Rapport de controle d'une image, voir ftdos.verify()
+    fs = ftdos(diskname, use_mmap=use_mmap)
+    try:
+        params = fs.validate(diskname)
+
+        if params is None:
+            return {'image': diskname, 'status': 'invalid'}
+
+        report = fs.verify()
+        report['image'] = diskname
+        report['volume'] = _text(fs.diskname or fs.read_diskname())
+        report['geometry'] = {'sides': fs.sides, 'tracks': fs.tracks, 'sectors': fs.sectors}
+
+        return report
+
+    finally:
+        fs.close()
+
+
+def image_signature(diskname, use_mmap=True, cache=None):
+    # Resume d'une image pour diff_signatures(), voir ftdos.sector_signature()
+    fs = ftdos(diskname, cache=cache, use_mmap=use_mmap)
+    try:
+        if fs.validate(diskname) is None:
+            raise ValueError('Invalid disk image')
+
+        signature = fs.sector_signature()
+        signature['image'] = diskname
+        signature['volume'] = _text(fs.read_diskname())
+
+        return signature
+
+    finally:
+        fs.close()
+
+
+def diff_signatures(reference, other):
+    # Comparaison des empreintes des secteurs de deux images, les secteurs
+    # differents sont rattaches aux fichiers et aux zones du disque (boot,
+    # systeme, bitmap, catalogue) de l'une ou l'autre image.
+    ref_hashes = reference['hashes']
+    hashes = other['hashes']
+
+    sectors = {'changed': [], 'missing': [], 'added': []}
+    for key in sorted(set(ref_hashes) | set(hashes)):
+        if key not in hashes:
+            sectors['missing'].append(key)
+        elif key not in ref_hashes:
+            sectors['added'].append(key)
+        elif ref_hashes[key] != hashes[key]:
+            sectors['changed'].append(key)
+
+    differ = set(itertools.chain(*sectors.values()))
+
+    owners = {}
+    for signature in (reference, other):
+        for name, record in signature['files'].items():
+            for key in record['fcb'] + record['data']:
+                owners.setdefault(key, set()).add(name)
+
+    regions = {}
+    unallocated = []
+    for key in sorted(differ):
+        if key in owners:
+            continue
+
+        region = reference['regions'].get(key) or other['regions'].get(key)
+        if region is not None:
+            regions.setdefault(region, []).append(list(key))
+        else:
+            unallocated.append(list(key))
+
+    # Fichiers: contenu compare secteur par secteur au travers des
+    # empreintes, un fichier identique range ailleurs est 'moved'
+    ref_files = reference['files']
+    files = other['files']
+
+    report_files = {'added': sorted(set(files) - set(ref_files)),
+                    'removed': sorted(set(ref_files) - set(files)),
+                    'changed': [],
+                    'moved': []
+                    }
+
+    for name in sorted(set(files) & set(ref_files)):
+        a = ref_files[name]
+        b = files[name]
+
+        content_a = [ref_hashes.get(key) for key in a['data']]
+        content_b = [hashes.get(key) for key in b['data']]
+
+        if 'error' in a or 'error' in b or a['size'] != b['size'] or content_a != content_b:
+            report_files['changed'].append(name)
+        elif a['fcb'] != b['fcb'] or a['data'] != b['data']:
+            report_files['moved'].append(name)
+        elif differ.intersection(a['fcb']):
+            report_files['changed'].append(name)
+
+    return {'reference': reference['image'],
+            'image': other['image'],
+            'volume': other['volume'],
+            'status': 'different' if differ else 'identical',
+            'sectors': dict([(kind, [list(key) for key in keys]) for kind, keys in sectors.items()]),
+            'regions': regions,
+            'unallocated': unallocated,
+            'files': report_files
+            }
+
+
+def diff_image(reference, diskname, use_mmap=True, cache=None):
+    # Comparaison d'une image a la signature d'une image de reference
+    # (image_signature), calculee une seule fois pour toutes les images
+    return diff_signatures(reference, image_signature(diskname, use_mmap, cache))
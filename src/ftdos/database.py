@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: database.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.4 $
+#
+# Base SQLite des catalogues d'un ensemble d'images FTDOS: volume, entrees
+# du catalogue, tailles, adresses de chargement et d'execution et empreinte
+# du contenu de chaque fichier.
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+
+from .core import ftdos, sha1_file, _text
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    sha1 TEXT,
+    status TEXT,
+    error TEXT,
+    volume TEXT,
+    indexed REAL
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    image_id INTEGER NOT NULL,
+    name TEXT,
+    stripped_name TEXT,
+    ext TEXT,
+    type TEXT,
+    content_type TEXT,
+    lock TEXT,
+    sectors INTEGER,
+    size INTEGER,
+    start INTEGER,
+    end INTEGER,
+    exec INTEGER,
+    sha1 TEXT,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS files_image ON files(image_id);
+CREATE INDEX IF NOT EXISTS files_name ON files(stripped_name);
+CREATE INDEX IF NOT EXISTS files_ext ON files(ext);
+CREATE INDEX IF NOT EXISTS files_content_type ON files(content_type);
+CREATE INDEX IF NOT EXISTS files_start ON files(start);
+CREATE INDEX IF NOT EXISTS files_exec ON files(exec);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files(sha1);
+'''
+
+FILE_COLUMNS = ('name', 'stripped_name', 'ext', 'type', 'content_type', 'lock', 'sectors', 'size', 'start', 'end', 'exec', 'sha1', 'error')
+
+
+# ------------------------------------------------------------------------------
+def index_image(job):
+    # Analyse d'une image pour la base. L'image n'est relue que si son
+    # contenu a change depuis la derniere indexation (job['sha1']).
+    path = job['path']
+    result = {'path': path, 'size': job['size'], 'mtime': job['mtime'], 'sha1': None, 'files': []}
+
+    try:
+        result['sha1'] = sha1_file(path)
+
+        if result['sha1'] == job['sha1']:
+            result['status'] = 'unchanged'
+            return result
+
+        fs = ftdos(path, use_mmap=job['use_mmap'])
+        try:
+            if fs.validate(path) is None:
+                result['status'] = 'invalid'
+                return result
+
+            result['volume'] = _text(fs.read_diskname())
+
+            for entry in fs.read_dir().values():
+                record = {'name': _text(entry.name),
+                          'stripped_name': _text(entry.stripped_name),
+                          'ext': _text(entry.ext),
+                          'type': _text(entry.type),
+                          'content_type': _text(entry.content_type),
+                          'lock': _text(entry.lock),
+                          'sectors': entry.size
+                          }
+
+                try:
+                    info = fs.file_info(entry.name)
+
+                    sha = hashlib.sha1()
+                    for chunk in fs.iter_file(entry.name, info['size']):
+                        sha.update(chunk)
+
+                    record.update({'size': info['size'], 'start': info['start'], 'end': info['end'], 'exec': info['exec'], 'sha1': sha.hexdigest()})
+
+                except Exception as e:
+                    record['error'] = '%s: %s' % (e.__class__.__name__, e)
+
+                result['files'].append(record)
+
+        finally:
+            fs.close()
+
+        result['status'] = 'ok'
+
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+
+    return result
+
+
+def _regexp(pattern, value):
+    return value is not None and re.search(pattern, value, re.IGNORECASE) is not None
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_Database():
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.create_function('REGEXP', 2, _regexp)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def known(self):
+        # chemin -> (taille, date de modification, empreinte)
+        return dict([(row['path'], (row['size'], row['mtime'], row['sha1'])) for row in self.db.execute('SELECT path, size, mtime, sha1 FROM images')])
+
+    def jobs(self, images, use_mmap=True):
+        # Images a (re)indexer: nouvelles, ou dont la taille ou la date de
+        # modification a change
+        known = self.known()
+        jobs = []
+
+        for path in images:
+            path = os.path.abspath(path)
+            previous = known.get(path)
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Image absente ou illisible: l'erreur est enregistree par
+                # index_image()
+                jobs.append({'path': path, 'size': None, 'mtime': None, 'sha1': None, 'use_mmap': use_mmap})
+                continue
+
+            if previous is not None and previous[0] == st.st_size and previous[1] == st.st_mtime:
+                continue
+
+            jobs.append({'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'sha1': previous[2] if previous is not None else None, 'use_mmap': use_mmap})
+
+        return jobs
+
+    def store(self, result):
+        cursor = self.db.cursor()
+
+        if result['status'] == 'unchanged':
+            # Meme contenu, seule la date de modification a change
+            cursor.execute('UPDATE images SET size = ?, mtime = ? WHERE path = ?', (result['size'], result['mtime'], result['path']))
+            return
+
+        row = cursor.execute('SELECT id FROM images WHERE path = ?', (result['path'],)).fetchone()
+        values = (result['size'], result['mtime'], result['sha1'], result['status'], result.get('error'), result.get('volume'), time.time())
+
+        if row is None:
+            cursor.execute('INSERT INTO images (size, mtime, sha1, status, error, volume, indexed, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', values + (result['path'],))
+            image_id = cursor.lastrowid
+        else:
+            image_id = row['id']
+            cursor.execute('DELETE FROM files WHERE image_id = ?', (image_id,))
+            cursor.execute('UPDATE images SET size = ?, mtime = ?, sha1 = ?, status = ?, error = ?, volume = ?, indexed = ? WHERE id = ?', values + (image_id,))
+
+        cursor.executemany('INSERT INTO files (image_id, %s) VALUES (?%s)' % (', '.join(FILE_COLUMNS), ', ?' * len(FILE_COLUMNS)),
+                           [(image_id,) + tuple([record.get(column) for column in FILE_COLUMNS]) for record in result['files']])
+
+    def prune(self):
+        # Suppression des images qui n'existent plus
+        missing = [(row['id'],) for row in self.db.execute('SELECT id, path FROM images') if not os.path.exists(row['path'])]
+
+        self.db.executemany('DELETE FROM files WHERE image_id = ?', missing)
+        self.db.executemany('DELETE FROM images WHERE id = ?', missing)
+
+        return len(missing)
+
+    def commit(self):
+        self.db.commit()
+
+    def query(self, patterns=(), regex=(), extensions=(), types=(), content_types=(), min_size=None, max_size=None, address=None, exec_addr=None, sha1=None, volume=None):
+        # Fichiers correspondant a tous les criteres. Les motifs et les
+        # expressions regulieres portent sur le nom reduit ('NOM.EXT'), les
+        # tailles sont en secteurs, address est une adresse comprise dans la
+        # zone de chargement du fichier.
+        where = []
+        args = []
+
+        def any_of(expression, values):
+            where.append('(%s)' % ' OR '.join([expression] * len(values)))
+            args.extend(values)
+
+        names = ['stripped_name GLOB ?'] * len(patterns) + ['stripped_name REGEXP ?'] * len(regex)
+        if names:
+            where.append('(%s)' % ' OR '.join(names))
+            args.extend([pattern.upper() for pattern in patterns] + list(regex))
+
+        if extensions:
+            any_of('ext = ?', [ext.upper() for ext in extensions])
+
+        if types:
+            any_of('type = ?', [t.upper() for t in types])
+
+        if content_types:
+            any_of('content_type = ?', list(content_types))
+
+        for expression, value in (('sectors >= ?', min_size), ('sectors <= ?', max_size), ('start <= ? ', address), ('exec = ?', exec_addr), ('files.sha1 = ?', sha1)):
+            if value is not None:
+                where.append(expression)
+                args.append(value)
+
+        if address is not None:
+            where.append('? < end')
+            args.append(address)
+
+        if volume is not None:
+            where.append('rtrim(volume) GLOB ?')
+            args.append(volume.upper())
+
+        sql = 'SELECT images.path AS image, images.volume AS volume, %s FROM files JOIN images ON images.id = files.image_id' % ', '.join(['files.%s AS %s' % (column, column) for column in FILE_COLUMNS])
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY images.path, files.name'
+
+        return [dict(zip(row.keys(), tuple(row))) for row in self.db.execute(sql, args)]
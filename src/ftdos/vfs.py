@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: vfs.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.4 $
+#
+# Systeme de fichiers virtuel en lecture seule sur une image FTDOS.
+#
+# FTDOS_VFS s'utilise directement (listdir, getattr, read) ou au travers de
+# FUSE avec mount(), qui necessite fusepy.
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import os
+import io
+import stat
+import errno
+import threading
+
+from .core import write_header
+
+# Vues avec en-tete: NOM.EXT.orix, NOM.EXT.tape
+HEADERS = ('orix', 'tape')
+
+
+# ------------------------------------------------------------------------------
+class FTDOS_VFS():
+    # Un repertoire unique: les fichiers du catalogue, et pour chacun les
+    # fichiers freres avec en-tete. Les lectures passent par ftdos.read_at(),
+    # seuls les secteurs demandes sont lus et la table des secteurs de chaque
+    # fichier n'est construite qu'une fois.
+    def __init__(self, fs, headers=HEADERS, system=False):
+        self.fs = fs
+        self.headers = tuple(headers)
+        self.system = system
+
+        self._lock = threading.Lock()
+        self._header_cache = {}
+
+        try:
+            self.mtime = os.stat(fs.source).st_mtime
+        except (OSError, TypeError):
+            self.mtime = 0
+
+        self.refresh()
+
+    def refresh(self):
+        # nom -> (nom dans le catalogue, en-tete)
+        with self._lock:
+            entries = list(self.fs.read_dir().values())
+            if self.system:
+                entries.extend(self.fs.system_entries())
+
+            self.nodes = {}
+            for entry in entries:
+                self.nodes[entry.stripped_name] = (entry.name, None)
+
+                for header in self.headers:
+                    self.nodes['%s.%s' % (entry.stripped_name, header)] = (entry.name, header)
+
+            self._header_cache = {}
+
+    def _node(self, path):
+        name = path.lstrip('/')
+
+        if name not in self.nodes:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+        return self.nodes[name]
+
+    def _header(self, filename, header):
+        if header is None:
+            return b''
+
+        key = (filename, header)
+        if key not in self._header_cache:
+            output = io.BytesIO()
+            write_header(output, filename, self.fs.file_info(filename), header)
+            self._header_cache[key] = output.getvalue()
+
+        return self._header_cache[key]
+
+    def listdir(self, path='/'):
+        if path.strip('/'):
+            raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+
+        return sorted(self.nodes.keys())
+
+    def getattr(self, path):
+        if not path.strip('/'):
+            return {'st_mode': stat.S_IFDIR | 0o555, 'st_nlink': 2, 'st_size': 0,
+                    'st_mtime': self.mtime, 'st_ctime': self.mtime, 'st_atime': self.mtime}
+
+        filename, header = self._node(path)
+
+        with self._lock:
+            size = len(self._header(filename, header)) + self.fs.file_size(filename)
+
+        return {'st_mode': stat.S_IFREG | 0o444, 'st_nlink': 1, 'st_size': size,
+                'st_mtime': self.mtime, 'st_ctime': self.mtime, 'st_atime': self.mtime}
+
+    def read(self, path, size, offset=0):
+        filename, header = self._node(path)
+
+        with self._lock:
+            hdr = self._header(filename, header)
+
+            chunks = []
+            if offset < len(hdr):
+                chunks.append(hdr[offset:offset + size])
+
+            remaining = size - sum([len(chunk) for chunk in chunks])
+            if remaining > 0:
+                chunks.append(self.fs.read_at(filename, max(offset - len(hdr), 0), remaining))
+
+        return b''.join(chunks)
+
+
+# ------------------------------------------------------------------------------
+def mount(vfs, mountpoint, foreground=True):
+    try:
+        import fuse
+    except ImportError:
+        raise ImportError('fusepy is required to mount FTDOS images')
+
+    class Operations(fuse.Operations):
+        # Les OSError du VFS sont renvoyees a FUSE avec leur errno
+        def __call__(self, op, *args):
+            try:
+                return fuse.Operations.__call__(self, op, *args)
+            except OSError as e:
+                raise fuse.FuseOSError(e.errno)
+
+        def getattr(self, path, fh=None):
+            return vfs.getattr(path)
+
+        def readdir(self, path, fh):
+            return ['.', '..'] + vfs.listdir(path)
+
+        def open(self, path, flags):
+            vfs.getattr(path)
+
+            if flags & (os.O_WRONLY | os.O_RDWR):
+                raise OSError(errno.EROFS, os.strerror(errno.EROFS), path)
+
+            return 0
+
+        def read(self, path, size, offset, fh):
+            return vfs.read(path, size, offset)
+
+    fuse.FUSE(Operations(), mountpoint, foreground=foreground, ro=True, nothreads=True)
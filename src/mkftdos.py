@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: mkftdos.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.1 $
+#
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import sys
+import struct
+import random
+import binascii
+
+import argparse
+
+# ------------------------------------------------------------------------------
+__program_name__ = 'mkftdos'
+__description__ = "Generation d'images FTDOS de test"
+__version__ = 0.1
+
+TRACKSIZE = 6400
+SECTORS = 17
+SECTORSIZE = 256
+
+# Pistes reservees: boot, systeme et catalogue
+BOOT_TRACK = 0
+CATALOG_TRACK = 20
+
+# Premiere piste du systeme selon la version de la ROM
+SYSTEM_TRACK = {'1.0': 4, '1.1': 0}
+
+EXTENSIONS = ['BAS', 'BIN', 'CMD', 'SCR', 'TXT', 'DAT', 'ARY']
+
+
+# ------------------------------------------------------------------------------
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def crc(data):
+    # CRC-CCITT MFM, calcule a partir des 3 octets de synchronisation A1
+    return struct.pack('>H', binascii.crc_hqx(data, binascii.crc_hqx(b'\xa1\xa1\xa1', 0xffff)))
+
+
+def build_track(P, side, sectors):
+    # Piste MFM_DISK: gap, puis pour chaque secteur ID + donnees
+    track = [b'\x4e' * 40]
+
+    for S in range(1, SECTORS + 1):
+        data = sectors.get(S, b'\x00' * SECTORSIZE)
+        id_field = b'\xfe' + struct.pack('4B', P, side, S, 1)
+
+        track.append(b'\x00' * 12 + b'\xa1' * 3 + id_field + crc(id_field))
+        track.append(b'\x4e' * 22 + b'\x00' * 12 + b'\xa1' * 3 + b'\xfb' + data + crc(b'\xfb' + data))
+        track.append(b'\x4e' * 24)
+
+    track = b''.join(track)
+    return track + b'\x4e' * (TRACKSIZE - len(track))
+
+
+def random_files(count, min_size=256, max_size=8192, seed=0):
+    rnd = random.Random(seed)
+    files = []
+
+    for i in range(0, count):
+        ext = EXTENSIONS[i % len(EXTENSIONS)]
+        size = rnd.randint(min_size, max_size)
+        if ext == 'ARY':
+            # Les tableaux ont une longueur paire
+            size += size % 2
+        data = bytes(bytearray([rnd.randint(0, 255) for _ in range(0, size)]))
+        files.append(('F%06d' % i, ext, data))
+
+    return files
+
+
+class FTDOS_Image():
+    def __init__(self, sides=2, tracks=41, fragmentation=0.0, seed=0, diskname='BENCH', rom='1.0'):
+        if sides * tracks * 3 > 246:
+            raise ValueError('Bitmap trop petit pour %d face(s) de %d pistes' % (sides, tracks))
+
+        if tracks <= CATALOG_TRACK:
+            raise ValueError('Au moins %d pistes necessaires' % (CATALOG_TRACK + 1))
+
+        self.sides = sides
+        self.tracks = tracks
+        self.fragmentation = fragmentation
+        self.diskname = diskname
+        self.rnd = random.Random(seed)
+        self.system_tracks = range(SYSTEM_TRACK[rom], SYSTEM_TRACK[rom] + 4)
+
+        # Secteurs ecrits: (piste, secteur) -> donnees (face 0 uniquement)
+        self.disk = {}
+        self.entries = []
+
+        reserved = [BOOT_TRACK, CATALOG_TRACK] + list(self.system_tracks)
+        self.free = [(P, S) for P in range(0, tracks) if P not in reserved for S in range(1, SECTORS + 1)]
+
+        for P in self.system_tracks:
+            for S in range(1, SECTORS + 1):
+                self.put(P, S, struct.pack('B', (P * SECTORS + S) & 0xff) * SECTORSIZE)
+
+        self.put(BOOT_TRACK, 1, b'\x00' * SECTORSIZE)
+
+    def put(self, P, S, data):
+        self.disk[(P, S)] = data.ljust(SECTORSIZE, b'\x00')
+
+    def allocate(self):
+        if not self.free:
+            raise ValueError('Disque plein')
+
+        # Allocation sequentielle, ou aleatoire selon le taux de fragmentation
+        if self.fragmentation > 0 and self.rnd.random() < self.fragmentation:
+            return self.free.pop(self.rnd.randrange(len(self.free)))
+
+        return self.free.pop(0)
+
+    def add_file(self, name, ext, data, start=0x0501):
+        nsectors = (len(data) + SECTORSIZE - 1) // SECTORSIZE
+
+        # Taille ecrite dans le FCB comme par FT-DOS: un octet de moins pour
+        # les ecrans et les tableaux (voir ftdos.file_info())
+        size = len(data)
+        if ext == 'SCR' or (ext == 'ARY' and size % 2 == 0):
+            size -= 1
+
+        data_sectors = [self.allocate() for _ in range(0, nsectors)]
+
+        # 125 secteurs de donnees par FCB
+        chunks = [data_sectors[i:i + 125] for i in range(0, len(data_sectors), 125)] or [[]]
+        fcbs = [self.allocate() for _ in chunks]
+
+        for i, chunk in enumerate(chunks):
+            next_fcb = fcbs[i + 1] if i + 1 < len(fcbs) else (0xff, 0x00)
+
+            fcb = struct.pack('<2BHH', next_fcb[0], next_fcb[1], start, size)
+            fcb += b''.join([struct.pack('2B', P, S) for P, S in chunk])
+            self.put(fcbs[i][0], fcbs[i][1], fcb.ljust(SECTORSIZE, b'\xff'))
+
+        for i, (P, S) in enumerate(data_sectors):
+            self.put(P, S, data[i * SECTORSIZE:(i + 1) * SECTORSIZE])
+
+        name = (name[0:8].ljust(8) + '.' + ext[0:3].ljust(3)).encode('ascii')
+        self.entries.append(struct.pack('<2B', fcbs[0][0], fcbs[0][1]) + b' ' + name + b'S' + struct.pack('<H', nsectors + len(fcbs)))
+
+    def build_catalog(self):
+        # 14 entrees par secteur, le premier secteur est en 20/2
+        count = max(1, (len(self.entries) + 13) // 14)
+        sectors = [(CATALOG_TRACK, 2)] + [(CATALOG_TRACK, S) for S in range(3, SECTORS + 1)]
+
+        while len(sectors) < count:
+            sectors.append(self.allocate())
+
+        for i in range(0, count):
+            P, S = sectors[i]
+            next_sector = sectors[i + 1] if i + 1 < count else (0xff, 0x00)
+
+            if i == 0:
+                data = struct.pack('4B', 0, 0, next_sector[0], next_sector[1])
+            else:
+                data = struct.pack('4B', P, S, next_sector[0], next_sector[1])
+
+            data += b''.join(self.entries[i * 14:(i + 1) * 14])
+            self.put(P, S, data.ljust(SECTORSIZE, b'\xff'))
+
+    def build_bitmap(self):
+        bitmap = []
+        free = set(self.free)
+
+        for T in range(0, self.sides * self.tracks):
+            P = T % self.tracks
+
+            if T < self.tracks and (P == BOOT_TRACK or P in self.system_tracks):
+                bitmap.append(struct.pack('3B', 0x00, 0x00, 0x80))
+                continue
+
+            bits = [T >= self.tracks or (P, S) in free for S in range(1, SECTORS + 1)]
+
+            b0 = b1 = 0
+            for j in range(0, 8):
+                b1 |= bits[1 + j] << (7 - j)
+                b0 |= bits[9 + j] << (7 - j)
+
+            bitmap.append(struct.pack('3B', b0, b1, int(bits[0])))
+
+        bitmap = b''.join(bitmap).ljust(246, b'\x00') + b'\x80\x80'
+        self.put(CATALOG_TRACK, 1, bitmap + self.diskname[0:8].ljust(8).encode('ascii'))
+
+    def save(self, filename):
+        self.build_catalog()
+        self.build_bitmap()
+
+        with open(filename, 'wb') as f:
+            f.write((b'MFM_DISK' + struct.pack('<3L', self.sides, self.tracks, 1)).ljust(256, b'\x00'))
+
+            for side in range(0, self.sides):
+                for P in range(0, self.tracks):
+                    sectors = {}
+                    if side == 0:
+                        for S in range(1, SECTORS + 1):
+                            if (P, S) in self.disk:
+                                sectors[S] = self.disk[(P, S)]
+
+                    f.write(build_track(P, side, sectors))
+
+
+def make_image(filename, files, sides=2, tracks=41, fragmentation=0.0, seed=0, diskname='BENCH', rom='1.0'):
+    image = FTDOS_Image(sides, tracks, fragmentation, seed, diskname, rom)
+
+    for name, ext, data in files:
+        image.add_file(name, ext, data)
+
+    image.save(filename)
+    return image
+
+
+# ------------------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(prog=__program_name__, description=__description__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('diskname', type=str, help='Disk image file')
+    parser.add_argument('--sides', type=int, default=2, help='number of sides')
+    parser.add_argument('--tracks', type=int, default=41, help='number of tracks per side')
+    parser.add_argument('--files', type=int, default=20, help='number of files')
+    parser.add_argument('--min-size', type=int, default=256, help='minimum file size')
+    parser.add_argument('--max-size', type=int, default=8192, help='maximum file size')
+    parser.add_argument('--fragmentation', type=float, default=0.0, help='probability of a random sector allocation (0-1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--volume', type=str, default='BENCH', help='volume name')
+    parser.add_argument('--rom', type=str, default='1.0', choices=sorted(SYSTEM_TRACK.keys()), help='system tracks layout (ROM version)')
+    parser.add_argument('--version', '-V', action='version', version='%%(prog)s v%s' % __version__)
+
+    args = parser.parse_args()
+
+    try:
+        files = random_files(args.files, args.min_size, args.max_size, args.seed)
+        make_image(args.diskname, files, args.sides, args.tracks, args.fragmentation, args.seed, args.volume, args.rom)
+
+    except ValueError as e:
+        eprint(e)
+        sys.exit(1)
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# vim: set ts=4 ai :
+#
+# $Id: test_mfm.py $
+# $Author: assinie <github@assinie.info> $
+# $Date: 2018-02-27 $
+# $Revision: 0.1 $
+#
+# L'analyseur compile (_ftdos_mfm.scan) doit produire exactement l'index de
+# l'analyseur Python (build_index_python), y compris sur des images
+# endommagees ou tronquees.
+#
+#   python -m unittest discover tests
+# ------------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import ftdos
+import ftdos.core
+import mkftdos
+
+
+# ------------------------------------------------------------------------------
+@unittest.skipIf(ftdos.core._ftdos_mfm is None, '_ftdos_mfm is not built')
+class TestScan(unittest.TestCase):
+    IMAGES = 4
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.images = []
+
+        for i in range(0, cls.IMAGES):
+            filename = os.path.join(cls.directory, 'gen%d.dsk' % i)
+            mkftdos.make_image(filename, mkftdos.random_files(12, seed=i), fragmentation=0.3 * i, seed=i, rom=('1.0', '1.1')[i % 2])
+
+            with open(filename, 'rb') as f:
+                cls.images.append(f.read())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def compare(self, data):
+        # Les deux analyseurs sur les memes octets, avec la geometrie de
+        # l'en-tete d'origine (validate rejetterait une image tronquee)
+        filename = os.path.join(self.directory, 'test.dsk')
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+        fs = ftdos.ftdos(filename, use_mmap=False)
+        try:
+            fs.offset = 0x100
+            fs.sides = 2
+            fs.tracks = 41
+
+            index = fs.build_index_python()
+            self.assertEqual(index, ftdos.core._ftdos_mfm.scan(fs.open_image(), fs.offset, fs.sides, fs.tracks, fs.tracksize, ftdos.SectorLoc))
+
+            return index
+
+        finally:
+            fs.close()
+
+    def test_generated(self):
+        for data in self.images:
+            self.assertEqual(len(self.compare(data)), 2 * 41 * 17)
+
+    def test_corrupted(self):
+        rnd = random.Random(0)
+
+        for data in self.images:
+            for n in (1, 16, 256, 4096):
+                image = bytearray(data)
+
+                # Octets quelconques et fausses marques d'ID et de donnees
+                for i in range(0, n):
+                    image[rnd.randrange(0x100, len(image))] = rnd.choice((rnd.randrange(0, 256), 0xfe, 0xfb))
+
+                self.compare(bytes(image))
+
+    def test_truncated(self):
+        rnd = random.Random(1)
+
+        for data in self.images:
+            for length in [0x100, 0x100 + 1, 0x100 + 6400 - 3, 0x100 + 6400 * 41 + 1] + [rnd.randrange(0x100, len(data)) for i in range(0, 8)]:
+                self.compare(data[:length])
+
+
+if __name__ == '__main__':
+    unittest.main()